@@ -0,0 +1,158 @@
+"""
+Times the scan engine over synthetic diffs and compares the throughput against the stored baselines.
+
+    python -m benchmarks.run                      # fails if any benchmark is slower than its baseline
+    python -m benchmarks.run --update-baselines   # stores the throughput measured on this machine
+
+Baselines depend on the machine, refresh them when moving to another one.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from benchmarks.corpus import generate_diffs
+from shhbt.gitclient.gitlab import FILE_RESULTS, _GitLab
+from shhbt.session import Session
+from shhbt.utils import extract_additions
+
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines.json")
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shhbt_config.yaml")
+
+# name: arguments of generate_diffs
+CORPORA = {
+    "typical": dict(seed=1, files=100),
+    "small_files": dict(seed=2, files=1000, lines=(1, 20)),
+    "long_lines": dict(seed=3, files=20, line_length=(200, 2000)),
+    "dirty": dict(seed=4, files=100, blacklist_ratio=0.5, secret_ratio=0.05),
+}
+
+
+def _client(session: Session) -> _GitLab:
+    return _GitLab(hostname="https://gitlab.invalid", token="benchmark", session=session)
+
+
+def bench_extract_additions(session: Session, diffs: List[Dict]) -> Callable[[], None]:
+    def run():
+        for d in diffs:
+            extract_additions(text=d["diff"])
+
+    return run
+
+
+def bench_process_file_change(session: Session, diffs: List[Dict]) -> Callable[[], None]:
+    client = _client(session)
+
+    def run():
+        FILE_RESULTS.clear()
+        for d in diffs:
+            client._process_file_change(d["new_path"], d["diff"])
+
+    return run
+
+
+def bench_process_changes(session: Session, diffs: List[Dict]) -> Callable[[], None]:
+    client = _client(session)
+
+    def run():
+        FILE_RESULTS.clear()
+        errors, _ = client._process_changes(namespace="benchmark", diffs=diffs)
+        assert not errors
+
+    return run
+
+
+BENCHMARKS = {
+    "extract_additions": bench_extract_additions,
+    "_process_file_change": bench_process_file_change,
+    "_process_changes": bench_process_changes,
+}
+
+
+def measure(run: Callable[[], None], repeat: int) -> float:
+    """
+    measure returns the fastest of repeat runs, in seconds, the one least disturbed by the rest of the machine.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def throughput(diffs: List[Dict], seconds: float) -> Dict[str, float]:
+    lines = sum(d["diff"].count("\n") for d in diffs)
+    return {"lines_per_s": round(lines / seconds), "files_per_s": round(len(diffs) / seconds)}
+
+
+def regressions(
+    results: Dict[str, Dict[str, float]], baselines: Dict[str, Dict[str, float]], tolerance: float
+) -> List[Tuple[str, str, float, float]]:
+    """
+    regressions compares results against the baselines.
+    :return: the benchmark, metric, result and baseline of every metric more than tolerance below its baseline.
+    """
+    slower = []
+    for name, metrics in sorted(results.items()):
+        for metric, value in sorted(metrics.items()):
+            baseline = baselines.get(name, {}).get(metric)
+            if baseline is not None and value < baseline * (1 - tolerance):
+                slower.append((name, metric, value, baseline))
+    return slower
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="benchmarks.run", description="Times the scan engine on synthetic diffs.")
+    parser.add_argument("--baselines", default=BASELINES, help="JSON file with the baselines")
+    parser.add_argument("--update-baselines", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="slowdown allowed before failing, 0.25 = 25%%")
+    parser.add_argument("--repeat", type=int, default=10, help="runs of each benchmark, the fastest one counts")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    args = parser.parse_args(argv)
+
+    # logging is not what is timed, and the shipped config has signatures some Python versions fail to compile
+    logging.disable(logging.CRITICAL)
+
+    with open(CONFIG) as f:
+        session = Session(config_content=f.read())
+
+    results = {}
+    for corpus, params in CORPORA.items():
+        diffs = generate_diffs(**params)
+        for bench, setup in BENCHMARKS.items():
+            name = f"{bench}/{corpus}"
+            if args.filter not in name:
+                continue
+            results[name] = throughput(diffs, measure(setup(session, diffs), args.repeat))
+            print(f"{name:40} {results[name]['lines_per_s']:>12,} lines/s {results[name]['files_per_s']:>10,} files/s")
+
+    if args.update_baselines:
+        baselines = {}
+        if os.path.exists(args.baselines):
+            with open(args.baselines) as f:
+                baselines = json.load(f)
+        baselines.update(results)
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Stored {len(results)} baselines in {args.baselines}.")
+        return 0
+
+    if not os.path.exists(args.baselines):
+        print(f"No baselines in {args.baselines}, run with --update-baselines first.")
+        return 1
+    with open(args.baselines) as f:
+        baselines = json.load(f)
+
+    slower = regressions(results, baselines, args.tolerance)
+    for name, metric, value, baseline in slower:
+        print(f"REGRESSION {name} {metric}: {value:,.0f}, baseline {baseline:,.0f}")
+    return 1 if slower else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
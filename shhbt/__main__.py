@@ -0,0 +1,154 @@
+import argparse
+import logging
+import os
+import sys
+from typing import Dict, List, Optional
+
+from shhbt.utils import configure_logging
+
+
+def _user_cache() -> str:
+    return os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "shhbt")
+
+
+def _read_config(parser: argparse.ArgumentParser, location: Optional[str]) -> str:
+    if not location:
+        parser.error("a config is required, pass --config or set CONFIG_LOCATION")
+    with open(location, mode="r") as f:
+        return f.read()
+
+
+def _write_report(report: Dict, output: Optional[str]):
+    import json
+
+    if output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(output, mode="w") as f:
+            json.dump(report, f, indent=2)
+
+
+def _scan_repo(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+    from dataclasses import asdict
+
+    from shhbt.repo import scan_repository
+
+    files, findings = scan_repository(args.path, _read_config(parser, args.config), workers=args.workers)
+    _write_report(
+        {"root": args.path, "files_scanned": files, "findings": [asdict(issue) for issue in findings]}, args.output
+    )
+    return 1 if findings else 0
+
+
+def _scan_history(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+    from dataclasses import asdict
+
+    from shhbt.history import scan_history
+
+    blobs, findings = scan_history(args.path, _read_config(parser, args.config), workers=args.workers)
+    _write_report(
+        {
+            "repository": args.path,
+            "blobs_scanned": blobs,
+            "findings": [{"commit": commit, "blob": blob, **asdict(issue)} for commit, blob, issue in findings],
+        },
+        args.output,
+    )
+    return 1 if findings else 0
+
+
+def _staged_diff(parser: argparse.ArgumentParser) -> str:
+    import subprocess  # nosec
+
+    try:
+        return subprocess.run(  # nosec
+            ["git", "diff", "--cached", "--no-color", "--no-ext-diff", "--unified=0"],
+            check=True,
+            stdout=subprocess.PIPE,
+        ).stdout.decode("utf-8", errors="replace")
+    except FileNotFoundError:
+        parser.error("git is required to scan the staged changes, or pipe a diff in")
+    except subprocess.CalledProcessError as e:
+        parser.error(f"could not read the staged changes, `git diff --cached` exited with {e.returncode}")
+
+
+def _scan_diff(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+    from shhbt.ruleset import RulesetCache
+    from shhbt.scanner import scan_file_change
+    from shhbt.session import Session
+    from shhbt.utils import iter_file_diffs
+
+    # hooks run on every commit, so the config is only parsed and analysed the first time
+    session = Session(config_content=_read_config(parser, args.config), rulesets=RulesetCache(directory=args.cache))
+
+    # a diff piped in is scanned as given, even if empty, and the staged changes otherwise
+    if args.cached or sys.stdin.isatty():
+        diff = _staged_diff(parser)
+    else:
+        diff = sys.stdin.read()
+
+    findings = [
+        issue for path, content in iter_file_diffs(diff) for issue in scan_file_change(session, path, content) if issue
+    ]
+    for issue in findings:
+        location = issue.file_rel_path if issue.line_number is None else f"{issue.file_rel_path}:{issue.line_number}"
+        print(f"{location}: {issue.signature_name}{' (aborted, too slow)' if issue.aborted else ''}")
+    return 1 if findings else 0
+
+
+def _compile(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+    from shhbt.ruleset import RulesetCache
+    from shhbt.session import Session
+
+    if not args.cache:
+        parser.error("a directory is required, pass --cache or set RULESET_CACHE")
+
+    rulesets = RulesetCache(directory=args.cache)
+    session = Session(config_content=_read_config(parser, args.config), rulesets=rulesets)
+    rulesets.store(session.ruleset())
+    print(rulesets.path(session.fingerprint))
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="shhbt", description="Looks for secrets outside of GitLab webhooks.")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    scan = commands.add_parser("scan", help="scan a diff piped in, or else the staged changes of a repository")
+    scan.add_argument("--config", default=os.getenv("CONFIG_LOCATION"), help="config to scan with")
+    scan.add_argument(
+        "--cache",
+        default=os.getenv("RULESET_CACHE") or _user_cache(),
+        help="directory to keep compiled configs in, ~/.cache/shhbt by default, empty to disable",
+    )
+    scan.add_argument("--cached", action="store_true", help="scan `git diff --cached` even if a diff is piped in")
+    scan.set_defaults(handler=_scan_diff)
+
+    compile_ = commands.add_parser("compile", help="compile a config into a ruleset later sessions load directly")
+    compile_.add_argument("config", nargs="?", default=os.getenv("CONFIG_LOCATION"), help="config to compile")
+    compile_.add_argument("--cache", default=os.getenv("RULESET_CACHE"), help="directory to write the ruleset to")
+    compile_.set_defaults(handler=_compile)
+
+    repo = commands.add_parser("repo", help="scan every file of a local checkout")
+    repo.add_argument("path", help="root of the checkout")
+    repo.add_argument("--config", default=os.getenv("CONFIG_LOCATION"), help="config to scan with")
+    repo.add_argument("--workers", type=int, default=None, help="worker processes, one per CPU by default")
+    repo.add_argument("--output", default=None, help="where to write the JSON report, stdout by default")
+    repo.set_defaults(handler=_scan_repo)
+
+    history = commands.add_parser("history", help="scan every blob in the history of a local repository")
+    history.add_argument("path", help="root of the repository")
+    history.add_argument("--config", default=os.getenv("CONFIG_LOCATION"), help="config to scan with")
+    history.add_argument("--workers", type=int, default=None, help="worker processes, one per CPU by default")
+    history.add_argument("--output", default=None, help="where to write the JSON report, stdout by default")
+    history.set_defaults(handler=_scan_history)
+
+    args = parser.parse_args(argv)
+    configure_logging(logging.WARNING)
+    return args.handler(parser, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,7 @@
 import re
 from abc import ABC, abstractmethod
 from enum import Enum
+from typing import List, Sequence, Set
 
 
 class BlacklistItem(ABC):
@@ -20,17 +21,53 @@ class Extension(BlacklistItem):
     def __init__(self, text: str):
         super().__init__()
         self.part = BlacklistItem.Types.EXTENSION
-        self.text = text
+        # configs may list extensions with their leading dot, e.g. ".jpg" or ".tar.gz"
+        self.text = text.lstrip(".")
 
     def match_item(self, file_path: str, extension: str) -> bool:
-        return self.text == extension
+        return self.text == extension or ("." in self.text and file_path.endswith(f".{self.text}"))
 
 
 class Path(BlacklistItem):
+    SEPARATOR = "{sep}"
+
     def __init__(self, text: str):
         super().__init__()
         self.part = BlacklistItem.Types.PATH
-        self.text = re.compile(f"^.*?(/{text}/).*?$")
+        # {sep} stands for the path separator, which is always a forward slash in git paths
+        self.pattern = text.replace(self.SEPARATOR, "/").strip("/")
+        self.text = re.compile(f"(?:^|/)(?:{self.pattern})/")
 
     def match_item(self, file_path: str, extension: str) -> bool:
         return self.text.search(file_path) is not None
+
+
+class BlacklistMatcher:
+    """
+    Compiled form of all the blacklist items of a session, so checking whether a file should be skipped costs a
+    single call: extensions are looked up in a set and every path entry is merged into one alternation.
+    """
+
+    def __init__(self, items: Sequence[BlacklistItem]):
+        self.extensions: Set[str] = set()
+        suffixes: List[str] = []
+        patterns: List[str] = []
+
+        for item in items:
+            if isinstance(item, Extension):
+                if "." in item.text:
+                    suffixes.append(f".{item.text}")
+                else:
+                    self.extensions.add(item.text)
+            elif isinstance(item, Path):
+                patterns.append(f"(?:{item.pattern})")
+
+        self._suffixes = tuple(suffixes)
+        self._paths = re.compile(f"(?:^|/)(?:{'|'.join(patterns)})/") if patterns else None
+
+    def match(self, file_path: str, extension: str) -> bool:
+        if extension in self.extensions:
+            return True
+        if self._suffixes and file_path.endswith(self._suffixes):
+            return True
+        return self._paths is not None and self._paths.search(file_path) is not None
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import astuple
+from typing import List, Optional
+
+from shhbt.data import Issue
+from shhbt.session import UNSAFE_SIGNATURES
+from shhbt.signatures import ContentMatcher
+
+# bumped whenever a change to scanning can change what is found in a file already scanned with the same config
+RESULTS_VERSION = 1
+
+
+class FileResultCache:
+    """
+    Bounded LRU of the findings of each scanned file change, keyed by the file path, the diff and the fingerprint of
+    the session that scanned it, along with the version and settings of the scanner that can change its findings.
+    Rebased or cherry-picked changes then skip the regex work altogether.
+    When given a path, results are also written through to a SQLite database, so they outlive the process.
+    """
+
+    def __init__(self, max_size: int = 65536, path: Optional[str] = None):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._results: "OrderedDict[str, List[Optional[Issue]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+
+        if path is not None and max_size > 0:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, hits TEXT, used INTEGER)")
+            self._db.commit()
+            self._writes = self._db.execute("SELECT COALESCE(MAX(used), 0) FROM results").fetchone()[0]
+
+    @staticmethod
+    def key(file_path: str, diff: str, fingerprint: str) -> str:
+        digest = hashlib.sha256()
+        scanner = f"{RESULTS_VERSION}:{ContentMatcher.LONG_LINE}:{ContentMatcher.SKIP_MINIFIED}:{UNSAFE_SIGNATURES}"
+        for part in (scanner, fingerprint, file_path, diff or ""):
+            digest.update(part.encode("utf-8", "surrogatepass"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[List[Optional[Issue]]]:
+        if self.max_size <= 0:
+            return None
+
+        with self._lock:
+            hits = self._results.get(key)
+            if hits is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return list(hits)
+
+            if self._db is not None:
+                row = self._db.execute("SELECT hits FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    hits = [None if issue is None else Issue(*issue) for issue in json.loads(row[0])]
+                    self._remember(key, hits)
+                    self._writes += 1
+                    self._db.execute("UPDATE results SET used = ? WHERE key = ?", (self._writes, key))
+                    self._db.commit()
+                    self.hits += 1
+                    return list(hits)
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, hits: List[Optional[Issue]]):
+        # scans cut short for taking too long may well finish the next time
+        if self.max_size <= 0 or any(issue is not None and issue.aborted for issue in hits):
+            return
+
+        with self._lock:
+            self._remember(key, list(hits))
+
+            if self._db is not None:
+                self._writes += 1
+                serialized = [None if issue is None else astuple(issue) for issue in hits]
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, hits, used) VALUES (?, ?, ?)",
+                    (key, json.dumps(serialized), self._writes),
+                )
+                # keep the database bounded as well, pruning in batches
+                if self._writes % 1024 == 0:
+                    self._db.execute(
+                        "DELETE FROM results WHERE used <= (SELECT MAX(used) FROM results) - ?", (self.max_size,)
+                    )
+                self._db.commit()
+
+    def _remember(self, key: str, hits: List[Optional[Issue]]):
+        self._results[key] = hits
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.hits = 0
+            self.misses = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
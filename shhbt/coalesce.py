@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class EventCoalescer:
+    """
+    Makes sure a given piece of work runs once per key: callers asking for a key that is already being worked on wait
+    for that run and share its result, and results are then kept for ttl seconds so repeated requests are answered
+    without running the work again. At most max_size results are kept, dropping the least recently used first.
+    """
+
+    def __init__(self, ttl: float = 600, max_size: int = 4096):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._results: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._in_flight: Dict[Hashable, _InFlight] = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: Hashable, work: Callable[[], Any], cacheable: Callable[[Any], bool] = lambda _: True) -> Any:
+        """
+        run returns the result of work for the given key, running it only if no recent or in-flight run exists.
+        Results for which cacheable returns False are shared with the callers already waiting, but not kept.
+        """
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                self._results.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = self._in_flight[key] = _InFlight()
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if not leader:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.result
+
+        try:
+            in_flight.result = work()
+        except BaseException as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if in_flight.error is None and self.ttl > 0 and cacheable(in_flight.result):
+                    self._results[key] = (time.monotonic() + self.ttl, in_flight.result)
+                    self._results.move_to_end(key)
+                    while len(self._results) > self.max_size:
+                        self._results.popitem(last=False)
+            in_flight.done.set()
+
+        return in_flight.result
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.hits = 0
+            self.misses = 0
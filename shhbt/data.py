@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Optional
 
 
 @dataclass
@@ -10,3 +11,6 @@ class Issue:
     nr_findings: int
     signature_name: str
     file_rel_path: str
+    line_number: Optional[int] = None
+    # the signature ran out of time on this file before scanning all of it
+    aborted: bool = False
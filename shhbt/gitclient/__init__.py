@@ -1,10 +1,16 @@
 from enum import Enum
 import logging
+import os
+import random
+import threading
+import time
 from abc import ABC, abstractmethod
 from typing import Any, Dict, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from shhbt.ratelimit import rate_limiter
 from shhbt.session import Session
 
 
@@ -14,18 +20,72 @@ class CommitStatus(Enum):
     PENDING = "pending"
 
 
+_HTTP_SESSIONS: Dict[Tuple[str, str], requests.Session] = {}
+_HTTP_SESSIONS_LOCK = threading.Lock()
+
+
+def http_session(hostname: str, token: str, pool_size: int = 16) -> requests.Session:
+    """
+    http_session returns the process-wide requests session of a hostname and token, creating it on first use, so
+    every client of the same instance keeps reusing the same keep-alive connections.
+    """
+    with _HTTP_SESSIONS_LOCK:
+        session = _HTTP_SESSIONS.get((hostname, token))
+        if session is None:
+            session = _HTTP_SESSIONS[(hostname, token)] = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        return session
+
+
 class GitClient(ABC):
-    def __init__(self, hostname: str, token: str) -> None:
+    # rate limited or transient server errors, worth another try
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, hostname: str, token: str, options: Optional["Options"] = None) -> None:
         super().__init__()
 
         if hostname == "" or token == "" or not hostname or not token:
             raise ValueError("Client cannot be instantiated without a valid hostname and token.")
 
         self.logger = logging.getLogger(__name__ + "." + self.__module__.split(".")[-1])
-        self.http_session = requests.Session()
+        self.options = options or Options()
+        self.http_session = http_session(hostname, token, pool_size=self.options.pool_size)
+        self.rate_limiter = rate_limiter(hostname, rate=self.options.rate_limit, burst=self.options.rate_burst)
         self.hostname = hostname
         self.token = token
 
+    def _request(
+        self, method: str, url: str, retry: Optional[bool] = None, priority: bool = False, **kwargs
+    ) -> requests.Response:
+        """
+        _request sends a request through the shared http session, once the rate limiter of the instance allows it.
+        Priority requests go ahead of the others waiting for the rate limiter.
+        Idempotent requests, GETs unless told otherwise, are retried on connection errors, rate limiting and transient
+        server errors, waiting a random time of up to an exponentially growing backoff between attempts.
+        """
+        retry = method == "GET" if retry is None else retry
+        attempts = self.options.retries + 1 if retry else 1
+        kwargs.setdefault("timeout", self.options.timeout)
+
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            self.rate_limiter.acquire(priority=priority)
+            try:
+                response = self.http_session.request(method=method, url=url, **kwargs)
+                self.rate_limiter.update(response.headers)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last:
+                    raise
+                self.logger.warning("%s %s failed with %s, retrying.", method, url, e)
+            else:
+                if last or response.status_code not in self.RETRY_STATUSES:
+                    return response
+                self.logger.warning("%s %s answered %s, retrying.", method, url, response.status_code)
+
+            time.sleep(random.uniform(0, self.options.backoff * 2**attempt))
+
     @abstractmethod
     def handle_event(self, event: Dict[str, Any]):
         pass
@@ -41,5 +101,33 @@ class Options:
     Pass the kwargs from the instantiated Client to override the default params.
     """
 
+    BACKEND_THREADS = "threads"
+    BACKEND_PROCESSES = "processes"
+
     def __init__(self, **kwargs):
-        self.threads = kwargs.get("threads", 4)
+        # threads shared by all events, rather than per event
+        self.threads = kwargs.get("threads", int(os.getenv("SCAN_THREADS", "4")))
+        # diffs with fewer files than this are scanned right away, without handing them to a pool
+        self.inline_files = kwargs.get("inline_files", int(os.getenv("SCAN_INLINE_FILES", "4")))
+        # processes scan outside the GIL, threads avoid moving diffs between processes
+        self.backend = kwargs.get("backend", os.getenv("SCAN_BACKEND", self.BACKEND_THREADS))
+        self.processes = kwargs.get("processes", int(os.getenv("SCAN_PROCESSES", os.cpu_count() or 1)))
+        self.process_batch_bytes = kwargs.get("process_batch_bytes", 256 * 1024)
+        # files per page of a diff, GitLab serves up to 100
+        self.diff_page_size = kwargs.get("diff_page_size", 100)
+        # files GitLab leaves out of diffs for being too large are fetched whole, this many at once across events,
+        # and up to raw_fetch_budget bytes per event
+        self.raw_fetch_threads = kwargs.get("raw_fetch_threads", int(os.getenv("RAW_FETCH_THREADS", "4")))
+        self.raw_fetch_budget = kwargs.get("raw_fetch_budget", int(os.getenv("RAW_FETCH_BUDGET", str(64 << 20))))
+
+        # connections kept per GitLab instance, and retries of idempotent requests
+        self.pool_size = kwargs.get("pool_size", int(os.getenv("HTTP_POOL_SIZE", "16")))
+        self.retries = kwargs.get("retries", int(os.getenv("HTTP_RETRIES", "3")))
+        self.backoff = kwargs.get("backoff", float(os.getenv("HTTP_BACKOFF", "0.5")))
+        self.timeout = kwargs.get("timeout", float(os.getenv("HTTP_TIMEOUT", "30")))
+        # requests per second to each GitLab instance, shared by every event
+        self.rate_limit = kwargs.get("rate_limit", float(os.getenv("HTTP_RATE_LIMIT", "30")))
+        self.rate_burst = kwargs.get("rate_burst", int(os.getenv("HTTP_RATE_BURST", "30")))
+
+        if self.backend not in (self.BACKEND_THREADS, self.BACKEND_PROCESSES):
+            raise ValueError(f"Unknown scan backend {self.backend}.")
@@ -1,17 +1,31 @@
 import base64
+import codecs
 import os
-from datetime import datetime, timedelta
-from multiprocessing.pool import ThreadPool
-from os.path import splitext
-from typing import Any, Dict, List, Optional, Tuple
+import threading
+from itertools import chain, islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import quote
 
+from shhbt.cache import FileResultCache
+from shhbt.coalesce import EventCoalescer
 from shhbt.data import Issue
 from shhbt.gitclient import CommitStatus, GitClient, Options
-from shhbt.session import Session
-from shhbt.utils import extract_additions
+from shhbt.scanner import iter_batches, process_scanner, scan_file_change, scan_file_lines, thread_executor
+from shhbt.session import SESSION_CACHE, ConfigWatcher
 
 
-def handle_gitlab_event(event_body: Dict[str, Any]):
+DEFAULT_CONFIG = ConfigWatcher()
+# verdicts per (project, commit, config fingerprint); GitLab sends several merge request events for the same commit
+VERDICTS = EventCoalescer(ttl=float(os.getenv("VERDICT_TTL", "600")))
+# findings per (path, diff, config fingerprint), shared by every event
+FILE_RESULTS = FileResultCache(
+    max_size=int(os.getenv("FILE_CACHE_SIZE", "65536")), path=os.getenv("FILE_CACHE_PATH", None)
+)
+# what files that were only partly downloaded are reported as
+RAW_FETCH_ABORTED = "Download budget"
+
+
+def handle_gitlab_event(event_body: Dict[str, Any], default_config: Optional[ConfigWatcher] = None):
     gitlab_token = os.getenv("GITLAB_TOKEN", None)
     gitlab_host = os.getenv("GITLAB_URI", None)
 
@@ -19,22 +33,41 @@ def handle_gitlab_event(event_body: Dict[str, Any]):
 
     exists, content = _cli.config_in_repo(proj_id=event_body.get("project", {}).get("id"))
     if exists:
-        _cli.session = Session(config_content=content)
+        # repos shipping the same config share one compiled session
+        _cli.session = SESSION_CACHE.get(content)
 
     else:
-        with open(file=os.getenv("CONFIG_LOCATION", "NOT_THIS_ONE"), mode="r") as f:
-            _cli.session = Session(config_content=f)
+        _cli.session = (default_config or DEFAULT_CONFIG).get()
 
     _cli.handle_event(event_body)
 
 
+class _ByteBudget:
+    """
+    Bytes an event may still download, shared by its concurrent fetches. Files that could not be downloaded whole are
+    left in its aborted set.
+    """
+
+    def __init__(self, limit: int):
+        self.left = limit
+        self.aborted: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def take(self, path: str, size: int) -> bool:
+        with self._lock:
+            if size > self.left:
+                self.left = 0
+                self.aborted.add(path)
+                return False
+            self.left -= size
+            return True
+
+
 class _GitLab(GitClient):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def __init__(self, hostname: str, token: str, **kwargs):
+        super().__init__(hostname, token, Options(**kwargs))
         self.http_session.headers.update({"PRIVATE-TOKEN": self.token})
-        self.last_request_at = datetime.now() - timedelta(hours=1)
         self.session = None if kwargs.get("session") is None else kwargs.get("session")
-        self.options = Options(**kwargs)
 
     def config_in_repo(self, proj_id: str) -> Tuple[bool, Optional[str]]:
         """ "
@@ -43,7 +76,7 @@ class _GitLab(GitClient):
         it loads the default file instead.
         Lastly, it decodes the contents from base64, which is the encoded format, according to the documentation.
         """
-        req = self.http_session.request(
+        req = self._request(
             method="GET",
             url=f"{self.hostname}/api/v4/projects/{proj_id}/repository/files/%2Eshhbt_config%2Eyaml?ref=master",
         )
@@ -58,25 +91,42 @@ class _GitLab(GitClient):
         """
         handle_event abstract the logic behind processing one event received. It sets base important variables, and
         also updates the commit status (which changes the MR).
-        Afterwards it fetches the diff and processes it accordingly.
+        Afterwards it fetches the diff and processes it accordingly. Events for a commit that was already scanned with
+        the same config, or that is being scanned, reuse that verdict and only post the final status.
         """
         proj_id = event.get("project", {}).get("id")
         namespace = event.get("project", {}).get("path_with_namespace")
         commit_sha = event.get("object_attributes", {}).get("last_commit", {}).get("id")
 
-        self._update_commit_status(proj_id, commit_sha, CommitStatus.PENDING)
-
-        diffs = self._fetch_diff(proj_id=proj_id, commit=commit_sha)
-        errors, findings = self._process_changes(namespace=namespace, diffs=diffs)
+        errors, findings = VERDICTS.run(
+            key=(proj_id, commit_sha, self.session.fingerprint),
+            work=lambda: self._scan_commit(proj_id, namespace, commit_sha),
+            # failed or partial scans are not kept, the next event gets to try again
+            cacheable=lambda verdict: not verdict[0] and not any(finding.aborted for finding in verdict[1]),
+        )
         if errors:
             self._update_commit_status(proj_id, commit_sha, CommitStatus.FAILED, findings)
 
         else:
-            if len(findings) > 0:
+            aborted = [finding for finding in findings if finding.aborted]
+            if aborted:
+                # the commit was not fully scanned, so it can't pass, and the signatures to blame are named
+                self._update_commit_status(proj_id, commit_sha, CommitStatus.FAILED, aborted)
+            elif len(findings) > 0:
                 self._update_commit_status(proj_id, commit_sha, CommitStatus.FAILED)
             else:
                 self._update_commit_status(proj_id, commit_sha, CommitStatus.SUCCESS)
 
+    def _scan_commit(self, proj_id: str, namespace: str, commit_sha: str) -> Tuple[bool, List[Issue]]:
+        """
+        _scan_commit marks the commit as pending, then fetches and scans its diff.
+        :return: a tuple that corresponds to whether any error occurred or not and the findings.
+        """
+        self._update_commit_status(proj_id, commit_sha, CommitStatus.PENDING)
+
+        diffs = self._fetch_diff(proj_id=proj_id, commit=commit_sha)
+        return self._process_changes(namespace=namespace, diffs=diffs, proj_id=proj_id, commit=commit_sha)
+
     def _update_commit_status(self, proj: str, commit: str, status: CommitStatus, findings: List[Issue] = None):
         """ "
         _update_commit_status takes all required logic to update a commit status on GitLab.
@@ -89,89 +139,193 @@ class _GitLab(GitClient):
             description = "No secrets found in modified code."
 
         if status == CommitStatus.FAILED and findings is not None:
-            description = "".join([f"{issue.signature_name}" for issue in findings])
+            description = "".join([f"{issue.signature_name}" for issue in findings if not issue.aborted])
+            aborted = sorted(
+                {f"{issue.signature_name} on {issue.file_rel_path}" for issue in findings if issue.aborted}
+            )
+            if aborted:
+                description += f"Aborted, out of budget: {'; '.join(aborted)}."
 
-        req = self.http_session.request(
+        # posting the same state again is harmless, so status updates are retried too, and go before any fetch
+        req = self._request(
             method="POST",
-            url=f"{self.hostname}/api/v4/projects/{proj}/statuses/{commit}?state={status.value}&description={description}",
+            url=f"{self.hostname}/api/v4/projects/{proj}/statuses/{commit}?state={status.value}"
+            f"&description={quote(description, safe='')}",
+            retry=True,
+            priority=True,
         )
         req.raise_for_status()
 
-    def _fetch_diff(self, proj_id: str, commit: str) -> List[Dict]:
+    def _fetch_diff(self, proj_id: str, commit: str) -> Iterator[Dict]:
         """
         _fetch_diff has the logic required to fetch a diff from GitLab so we can analyse only the differences between
-        two changes.
-        :returns: Python object of a given response body.
+        two changes. It walks all the pages of the diff, fetching each one once the previous one was consumed.
+        :returns: the changes of each file, as they arrive.
         """
-        req = self.http_session.request(
-            method="GET", url=f"{self.hostname}/api/v4/projects/{proj_id}/repository/commits/{commit}/diff"
-        )
-        req.raise_for_status()
+        per_page = self.options.diff_page_size
+        page = 1
+        while True:
+            req = self._request(
+                method="GET",
+                url=f"{self.hostname}/api/v4/projects/{proj_id}/repository/commits/{commit}/diff",
+                params={"page": page, "per_page": per_page},
+            )
+            req.raise_for_status()
 
-        return req.json()
+            changes = req.json()
+            yield from changes
+            if len(changes) < per_page:
+                return
+            page += 1
 
-    def _process_changes(self, namespace: str, diffs: List[Dict]) -> Tuple[bool, List["HitFind"]]:
+    def _process_changes(
+        self, namespace: str, diffs: Iterable[Dict], proj_id: str = None, commit: str = None
+    ) -> Tuple[bool, List["HitFind"]]:
         """
-        _process_changes takes all changes performed to a given file from a diff, and processes them in a multithreaded
-        implementation.
+        _process_changes takes all changes performed to a given file from a diff, and processes them either in the
+        shared thread pool or in worker processes, as set in the client options. Changes are handed over as they are
+        fetched, so scanning overlaps with fetching the next pages. Small diffs are processed inline.
+        Files GitLab left out of the diff for being too large are fetched whole from the commit, when given, and
+        scanned on their own.
         Skips deleted files
         :return: a tuple that corresponds to whether any error occurred or not and the findings.
         """
-        self.logger.info("Processing diffs. Received %s diffs.", len(diffs))
+        self.logger.info("Processing diffs.")
+
+        fetches = []
+        budget = _ByteBudget(self.options.raw_fetch_budget)
+
+        def changes():
+            for d in diffs:
+                if d.get("deleted_file"):
+                    continue
+                if commit and not d.get("diff") and (d.get("too_large") or d.get("collapsed")):
+                    fetches.append(
+                        thread_executor(self.options.raw_fetch_threads, name="fetch").submit(
+                            self._process_raw_file, proj_id, commit, d.get("new_path"), budget
+                        )
+                    )
+                    continue
+                yield d.get("new_path"), d.get("diff")
 
         try:
-            non_del_diffs = [d for d in diffs if not d.get("deleted_file")]
-            with ThreadPool(processes=self.options.threads) as pool:
-                findings = pool.starmap(
-                    self._process_file_change,
-                    [(d.get("new_path"), d.get("diff")) for d in non_del_diffs],
-                )
+            changes = changes()
+            head = list(islice(changes, self.options.inline_files))
+            if len(head) < self.options.inline_files:
+                findings = [self._process_file_change(new_path, content) for new_path, content in head]
+            elif self.options.backend == Options.BACKEND_PROCESSES:
+                findings = self._scan_in_processes(chain(head, changes))
+            else:
+                findings = self._scan_in_threads(chain(head, changes))
+            findings += [fetch.result() for fetch in fetches]
+            self.logger.info("Processed %s diffs.", len(findings))
             # removes None findings and merge all findings into single list for better processing.
             return False, [finding for sub_findings in findings for finding in sub_findings if finding]
         except Exception as e:
             self.logger.exception("Failed processing repository %s with error %s", namespace, e)
             return True, []
+
+    def _scan_in_threads(self, changes: Iterable[Tuple[str, str]]) -> List[List[Optional[Issue]]]:
+        executor = thread_executor(self.options.threads)
+        futures = [executor.submit(self._process_file_change, new_path, content) for new_path, content in changes]
+        return [future.result() for future in futures]
+
+    def _scan_in_processes(self, changes: Iterable[Tuple[str, str]]) -> List[List[Optional[Issue]]]:
+        """
+        _scan_in_processes hands the changes that are not cached yet to the shared pool of worker processes, a batch
+        at a time as they arrive.
+        """
+        findings: List[Optional[List[Optional[Issue]]]] = []
+        missing = []
+
+        def uncached():
+            for new_path, content in changes:
+                self.logger.info("Processing change in file %s", new_path)
+                key = FILE_RESULTS.key(new_path, content, self.session.fingerprint)
+                hits = FILE_RESULTS.get(key)
+                findings.append(hits)
+                if hits is None:
+                    missing.append((len(findings) - 1, key))
+                    yield new_path, content
+
+        scanner = process_scanner(self.options.processes)
+        pending = [
+            scanner.submit(self.session, batch) for batch in iter_batches(uncached(), self.options.process_batch_bytes)
+        ]
+        scanned = (hits for result in pending for hits in result())
+        for (position, key), hits in zip(missing, scanned):
+            FILE_RESULTS.put(key, hits)
+            findings[position] = hits
+
+        return findings
+
+    def _process_raw_file(
+        self, proj_id: str, commit: str, new_path: str, budget: "_ByteBudget"
+    ) -> List[Optional[Issue]]:
+        """
+        _process_raw_file scans the whole content of a file at the given commit, as it is downloaded. A file that the
+        byte budget of the event cut short is reported as aborted, since the rest of it was never scanned.
+        :return: a list of findings if any.
+        """
+        self.logger.info("Processing whole file %s", new_path)
+        hits = scan_file_lines(self.session, new_path, self._fetch_raw_lines(proj_id, commit, new_path, budget))
+        if new_path in budget.aborted:
+            hits.append(Issue(nr_findings=0, signature_name=RAW_FETCH_ABORTED, file_rel_path=new_path, aborted=True))
+        return hits
+
+    def _fetch_raw_lines(
+        self, proj_id: str, commit: str, new_path: str, budget: "_ByteBudget"
+    ) -> Iterator[Tuple[int, str]]:
+        """
+        _fetch_raw_lines streams the content of a file at the given commit from GitLab, a line at a time. It stops
+        early, with a warning, once the byte budget of the event is spent.
+        :returns: the number and content of each line.
+        """
+        req = self._request(
+            method="GET",
+            url=f"{self.hostname}/api/v4/projects/{proj_id}/repository/files/{quote(new_path, safe='')}/raw",
+            params={"ref": commit},
+            stream=True,
+        )
+        try:
+            req.raise_for_status()
+
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            line_number = 0
+            pending = ""
+            for chunk in req.iter_content(chunk_size=64 * 1024):
+                if not budget.take(new_path, len(chunk)):
+                    self.logger.warning("Stopped reading %s, out of budget for this event.", new_path)
+                    break
+                lines = (pending + decoder.decode(chunk)).split("\n")
+                pending = lines.pop()
+                for line in lines:
+                    line_number += 1
+                    yield line_number, line
+            else:
+                pending += decoder.decode(b"", final=True)
+
+            if pending:
+                yield line_number + 1, pending
         finally:
-            pool.close()
-            pool.join()
+            req.close()
 
     def _process_file_change(self, new_path, content) -> List[Optional[Issue]]:
         """
         _process_file_change handles processing each change separately. It uses the session that was preloaded into
         this client so it makes use of custom blacklists or signatures.
+        A change identical to one already scanned with the same session is not scanned again.
         :return: a list of findings if any.
         """
         self.logger.info("Processing change in file %s", new_path)
 
-        name_splits = new_path.split("/")
-        filename = name_splits[len(name_splits) - 1]
-        # extract extension from filename. Index 1 should be the extension
-        extension = splitext(filename)[1].lstrip(".")
-
-        for item in self.session.blacklists:
-            if item.match_item(file_path=new_path, extension=extension):
-                return [None]
-
-        additions = extract_additions(text=content)
-
-        hits: List[Issue] = []
-
-        for signature in self.session.signatures:
-            if signature.part == signature.PART_CONTENTS:
-                for add in additions:
-                    matches = signature.get_content_matches(content=add)
-                    if matches:
-                        hits.append(
-                            Issue(nr_findings=len(matches), signature_name=signature.name, file_rel_path=new_path)
-                        )
-            else:
-                matched, part = signature.match(
-                    path=new_path,
-                    filename=filename,
-                    extension=extension,
-                    content=content,
-                )
-                if matched:
-                    hits.append(Issue(nr_findings=1, file_rel_path=new_path, signature_name=signature.name))
+        key = FILE_RESULTS.key(new_path, content, self.session.fingerprint)
+        hits = FILE_RESULTS.get(key)
+        if hits is None:
+            hits = self._scan_file_change(new_path, content)
+            FILE_RESULTS.put(key, hits)
 
         return hits
+
+    def _scan_file_change(self, new_path, content) -> List[Optional[Issue]]:
+        return scan_file_change(self.session, new_path, content)
@@ -0,0 +1,214 @@
+import logging
+import os
+import subprocess  # nosec
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from os.path import splitext
+from typing import IO, Deque, Dict, Iterator, List, Optional, Tuple
+
+from shhbt.data import Issue
+from shhbt.repo import BINARY_SNIFF, iter_lines
+from shhbt.session import Session
+
+logger = logging.getLogger(__name__)
+
+# content findings of a blob: line number and number of findings, by signature index
+BlobHits = Dict[int, List[Tuple[int, int]]]
+
+# blobs are sent to the workers in batches of about this many bytes
+BATCH_BYTES = 4 << 20
+
+
+def _git(repo: str, *args: str, **kwargs) -> subprocess.Popen:
+    return subprocess.Popen(["git", "-C", repo, *args], stdout=subprocess.PIPE, **kwargs)  # nosec
+
+
+def _wait(process: subprocess.Popen):
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+
+def iter_blobs(repo: str) -> Iterator[Tuple[str, str, bytes]]:
+    """
+    iter_blobs streams every blob reachable from any ref of a repository, each exactly once however many commits
+    point to it, by piping `git rev-list --objects --all` into `git cat-file --batch`.
+    :returns: the sha of each blob, the first path it was found at, and its content.
+    """
+    rev_list = _git(repo, "rev-list", "--objects", "--all")
+    cat_file = _git(
+        repo, "cat-file", "--batch=%(objectname) %(objecttype) %(objectsize) %(rest)", stdin=rev_list.stdout
+    )
+    rev_list.stdout.close()
+
+    try:
+        for header in iter(cat_file.stdout.readline, b""):
+            fields = header.rstrip(b"\n").split(b" ", 3)
+            if fields[1] == b"missing":
+                continue
+            content = cat_file.stdout.read(int(fields[2]))
+            cat_file.stdout.read(1)
+            if fields[1] == b"blob":
+                yield fields[0].decode(), fields[3].decode("utf-8", errors="replace"), content
+    finally:
+        cat_file.stdout.close()
+        _wait(cat_file)
+        _wait(rev_list)
+
+
+def _iter_tokens(stream: IO[bytes], chunk_size: int = 1 << 16) -> Iterator[str]:
+    pending = b""
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        tokens = (pending + chunk).split(b"\0")
+        pending = tokens.pop()
+        for token in tokens:
+            yield token.decode("utf-8", errors="replace")
+    if pending:
+        yield pending.decode("utf-8", errors="replace")
+
+
+def iter_changes(repo: str) -> Iterator[Tuple[str, str, str, str]]:
+    """
+    iter_changes streams the files changed by every commit reachable from any ref of a repository, as listed by
+    `git log --raw`. Merges only list the changes they resolved.
+    :returns: the sha of each commit, the path changed, the sha of its new blob and the status of the change.
+    """
+    log = _git(repo, "log", "--all", "--raw", "--no-abbrev", "--no-renames", "-z", "--format=%H")
+    try:
+        commit = None
+        change = None
+        for token in _iter_tokens(log.stdout):
+            token = token.lstrip("\n")
+            if change is not None:
+                yield commit, token, change[3], change[4]
+                change = None
+            elif token.startswith(":"):
+                change = token[1:].split(" ")
+            elif token:
+                commit = token
+    finally:
+        log.stdout.close()
+        _wait(log)
+
+
+def scan_blob(session: Session, content: bytes) -> BlobHits:
+    if b"\0" in content[:BINARY_SNIFF]:
+        return {}
+    return session.content_matcher.scan(iter_lines(content))
+
+
+# session compiled once by each worker process
+_WORKER_SESSION: Optional[Session] = None
+
+
+def _init_worker(config_content: str):
+    global _WORKER_SESSION
+    _WORKER_SESSION = Session(config_content=config_content)
+
+
+def _scan_in_worker(blobs: List[Tuple[str, bytes]]) -> List[Tuple[str, BlobHits]]:
+    scanned = [(sha, scan_blob(_WORKER_SESSION, content)) for sha, content in blobs]
+    return [(sha, hits) for sha, hits in scanned if hits]
+
+
+def _blacklisted(session: Session, path: str) -> bool:
+    extension = splitext(path.split("/")[-1])[1].lstrip(".")
+    return session.blacklist_matcher.match(file_path=path, extension=extension)
+
+
+def _scan_blobs(repo: str, session: Session, workers: int) -> Tuple[int, Dict[str, BlobHits], Dict[str, str]]:
+    """
+    _scan_blobs scans every blob of a repository whose first path is not blacklisted.
+    :return: the number of blobs scanned, the content findings of each blob, and the first path of each blob.
+    """
+    hits: Dict[str, BlobHits] = {}
+    paths: Dict[str, str] = {}
+    blobs = 0
+
+    if workers == 1:
+        for sha, path, content in iter_blobs(repo):
+            if _blacklisted(session, path):
+                continue
+            blobs += 1
+            paths[sha] = path
+            found = scan_blob(session, content)
+            if found:
+                hits[sha] = found
+        return blobs, hits, paths
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(session.config_content,)) as pool:
+        # only a few batches are in flight at once, so the history is never held in memory
+        pending: Deque[Future] = deque()
+        batch: List[Tuple[str, bytes]] = []
+        size = 0
+        for sha, path, content in iter_blobs(repo):
+            if _blacklisted(session, path):
+                continue
+            blobs += 1
+            paths[sha] = path
+            batch.append((sha, content))
+            size += len(content)
+            if size >= BATCH_BYTES:
+                pending.append(pool.submit(_scan_in_worker, batch))
+                batch = []
+                size = 0
+                if len(pending) > workers * 2:
+                    hits.update(pending.popleft().result())
+        if batch:
+            pending.append(pool.submit(_scan_in_worker, batch))
+        for future in pending:
+            hits.update(future.result())
+
+    return blobs, hits, paths
+
+
+def _issues(session: Session, path: str, hits: BlobHits) -> List[Issue]:
+    return [
+        Issue(
+            nr_findings=nr_findings,
+            signature_name=session.signatures[index].name,
+            file_rel_path=path,
+            line_number=line_number,
+        )
+        for index in sorted(hits)
+        for line_number, nr_findings in hits[index]
+    ]
+
+
+def scan_history(
+    repo: str, config_content: str, workers: Optional[int] = None
+) -> Tuple[int, List[Tuple[Optional[str], str, Issue]]]:
+    """
+    scan_history scans every blob in the history of a local repository once, spread over a pool of worker processes,
+    then attributes the findings to each commit that added or changed a file to that blob. Files added at a path
+    matching a file signature are reported too. Blacklisted paths are left out, and blobs first found at one are not
+    scanned at all.
+    :return: the number of blobs scanned, and the commit, blob and issue of each finding. Findings in blobs no commit
+    change could be traced to, like those only in merge resolutions, have no commit.
+    """
+    session = Session(config_content=config_content)
+    blobs, hits, paths = _scan_blobs(repo, session, workers or os.cpu_count() or 1)
+
+    findings: List[Tuple[Optional[str], str, Issue]] = []
+    traced = set()
+    for commit, path, blob, status in iter_changes(repo):
+        if status == "D":
+            continue
+        traced.add(blob)
+        if _blacklisted(session, path):
+            continue
+        filename = path.split("/")[-1]
+        extension = splitext(filename)[1].lstrip(".")
+
+        if blob in hits:
+            findings.extend((commit, blob, issue) for issue in _issues(session, path, hits[blob]))
+        if status == "A":
+            for index in session.file_matcher.match(path=path, filename=filename, extension=extension):
+                issue = Issue(nr_findings=1, signature_name=session.signatures[index].name, file_rel_path=path)
+                findings.append((commit, blob, issue))
+
+    for blob in hits.keys() - traced:
+        if _blacklisted(session, paths[blob]):
+            continue
+        findings.extend((None, blob, issue) for issue in _issues(session, paths[blob], hits[blob]))
+
+    return blobs, findings
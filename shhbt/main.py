@@ -1,5 +1,7 @@
 from shhbt.server import create_flask_app
+from shhbt.utils import configure_logging
 
+configure_logging()
 
 app = create_flask_app()
 
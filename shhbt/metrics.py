@@ -0,0 +1,121 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+if TYPE_CHECKING:
+    from shhbt.session import Session
+
+# position of each counter in the list kept per signature
+CALLS, SECONDS, BYTES, HITS = range(4)
+
+
+def new_counters() -> List[float]:
+    return [0, 0.0, 0, 0]
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class SignatureMetrics:
+    """
+    Cost and hit rate of each signature, by session fingerprint and position of the signature in the session, added up
+    across every scan of the process: how many times it was evaluated, for how long, over how many characters, and how
+    many matches it found.
+    Scans only measure anything while it is enabled. Each scan counts into its own dict, added here once per file.
+    Counters are kept for up to max_configs sessions, dropping those of the least recently measured one first, and
+    those of sessions the session cache evicts.
+    """
+
+    METRICS = (
+        ("calls", "Evaluations of a signature.", CALLS),
+        ("seconds", "CPU time spent evaluating a signature.", SECONDS),
+        ("bytes", "Characters a signature was evaluated over.", BYTES),
+        ("hits", "Matches a signature found.", HITS),
+    )
+
+    def __init__(self, enabled: bool = False, max_configs: int = 128):
+        self.enabled = enabled
+        self.max_configs = max_configs
+        self._lock = threading.Lock()
+        # counters by session fingerprint and signature index, least recently measured session first
+        self._counters: "OrderedDict[str, Dict[int, List[float]]]" = OrderedDict()
+        # (name, part) of every signature of the sessions measured, by fingerprint
+        self._signatures: Dict[str, List[Tuple[str, str]]] = {}
+
+    def add(self, session: "Session", counters: Dict[int, List[float]]):
+        """
+        add adds the counters of a scan with the given session, by signature index.
+        """
+        with self._lock:
+            totals = self._counters.get(session.fingerprint)
+            if totals is None:
+                totals = self._counters[session.fingerprint] = {}
+                self._signatures[session.fingerprint] = [(sig.name, sig.part) for sig in session.signatures]
+                while len(self._counters) > self.max_configs:
+                    evicted, _ = self._counters.popitem(last=False)
+                    del self._signatures[evicted]
+            self._counters.move_to_end(session.fingerprint)
+            for index, values in counters.items():
+                total = totals.get(index)
+                if total is None:
+                    total = totals[index] = new_counters()
+                for position, value in enumerate(values):
+                    total[position] += value
+
+    def drain(self, fingerprint: str) -> Dict[int, List[float]]:
+        """
+        drain removes and returns the counters of the session with the given fingerprint, by signature index.
+        """
+        with self._lock:
+            self._signatures.pop(fingerprint, None)
+            return self._counters.pop(fingerprint, {})
+
+    def forget(self, fingerprint: str):
+        """
+        forget drops the counters of the session with the given fingerprint.
+        """
+        self.drain(fingerprint)
+
+    def snapshot(self) -> Dict[Tuple[str, int], List[float]]:
+        with self._lock:
+            return {
+                (fingerprint, index): list(values)
+                for fingerprint, totals in self._counters.items()
+                for index, values in totals.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._signatures.clear()
+
+    def render(self) -> str:
+        """
+        render returns the counters in the Prometheus text exposition format.
+        """
+        with self._lock:
+            counters = sorted(
+                ((fingerprint, index), list(values))
+                for fingerprint, totals in self._counters.items()
+                for index, values in totals.items()
+            )
+            signatures = dict(self._signatures)
+
+        lines = []
+        for metric, description, position in self.METRICS:
+            name = f"shhbt_signature_{metric}_total"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            for (fingerprint, index), values in counters:
+                signature, part = signatures[fingerprint][index]
+                labels = (
+                    f'config="{fingerprint[:12]}",index="{index}",signature="{_label(signature)}",part="{_label(part)}"'
+                )
+                lines.append(f"{name}{{{labels}}} {values[position]}")
+
+        return "\n".join(lines) + "\n"
+
+
+METRICS = SignatureMetrics(enabled=os.getenv("SIGNATURE_METRICS", "").lower() in ("1", "true", "yes"))
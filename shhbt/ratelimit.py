@@ -0,0 +1,106 @@
+import threading
+import time
+from typing import Callable, Dict, Mapping, Optional
+
+
+def _header_number(headers: Mapping, name: str) -> Optional[float]:
+    value = headers.get(name)
+    if not isinstance(value, (str, bytes, int, float)):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every request sent to a GitLab instance: up to burst requests may go out at once, then rate
+    requests per second. It follows what the instance reports, pausing when it asks to retry later or has no requests
+    left, and never spending more tokens than it says are remaining. Priority requests go ahead of the others waiting.
+    """
+
+    # longest pause the instance can ask for, so a bogus header does not stall every event
+    MAX_PAUSE = 300
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._priority_waiting = 0
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float):
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        else:
+            self._tokens = self.burst
+        self._updated = now
+
+    def acquire(self, priority: bool = False):
+        """
+        acquire blocks until a request may be sent.
+        """
+        with self._cond:
+            if priority:
+                self._priority_waiting += 1
+            try:
+                while True:
+                    now = self._clock()
+                    self._refill(now)
+                    wait = self._paused_until - now
+                    if wait <= 0:
+                        if not priority and self._priority_waiting:
+                            # woken up once the priority requests got their turn
+                            wait = None
+                        elif self._tokens >= 1:
+                            self._tokens -= 1
+                            return
+                        else:
+                            wait = (1 - self._tokens) / self.rate
+                    self._cond.wait(wait)
+            finally:
+                if priority:
+                    self._priority_waiting -= 1
+                    self._cond.notify_all()
+
+    def update(self, headers: Mapping):
+        """
+        update adapts the bucket to the RateLimit-Remaining, RateLimit-Reset and Retry-After headers of a response.
+        """
+        retry_after = _header_number(headers, "Retry-After")
+        remaining = _header_number(headers, "RateLimit-Remaining")
+        reset = _header_number(headers, "RateLimit-Reset")
+
+        with self._cond:
+            now = self._clock()
+            pause = None
+            if retry_after is not None:
+                pause = retry_after
+            elif remaining is not None and remaining < 1 and reset is not None:
+                # the reset header is a unix timestamp
+                pause = reset - time.time()
+            if pause is not None and pause > 0:
+                self._paused_until = max(self._paused_until, now + min(pause, self.MAX_PAUSE))
+
+            if remaining is not None:
+                self._refill(now)
+                self._tokens = min(self._tokens, remaining)
+
+
+_RATE_LIMITERS: Dict[str, RateLimiter] = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+def rate_limiter(hostname: str, rate: float, burst: int) -> RateLimiter:
+    """
+    rate_limiter returns the process-wide rate limiter of a GitLab instance, creating it on first use.
+    """
+    with _RATE_LIMITERS_LOCK:
+        limiter = _RATE_LIMITERS.get(hostname)
+        if limiter is None:
+            limiter = _RATE_LIMITERS[hostname] = RateLimiter(rate=rate, burst=burst)
+        return limiter
@@ -0,0 +1,116 @@
+import logging
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple, Union
+
+from shhbt.data import Issue
+from shhbt.scanner import scan_file_lines
+from shhbt.session import Session
+
+logger = logging.getLogger(__name__)
+
+# files larger than this are memory-mapped rather than read
+MMAP_THRESHOLD = 1 << 20
+# lines are decoded in blocks of about this many bytes
+DECODE_BLOCK = 1 << 20
+# like git, files with a NUL byte in their first bytes are taken for binaries and only matched on their names
+BINARY_SNIFF = 8000
+
+
+def iter_lines(data: Union[bytes, mmap.mmap], block: int = DECODE_BLOCK) -> Iterator[Tuple[int, str]]:
+    """
+    iter_lines decodes the lines of a file's content a block at a time, so a memory-mapped file is never copied whole.
+    :returns: the number and content of each line.
+    """
+    size = len(data)
+    if size == 0:
+        return
+    # a last newline ends the last line rather than starting an empty one
+    if data[size - 1 : size] == b"\n":
+        size -= 1
+    start = 0
+    line_number = 0
+    while True:
+        end = data.find(b"\n", start + block, size) if start + block < size else -1
+        if end == -1:
+            end = size
+        for line in data[start:end].decode("utf-8", errors="replace").split("\n"):
+            line_number += 1
+            yield line_number, line
+        if end == size:
+            return
+        start = end + 1
+
+
+def scan_file(session: Session, root: str, rel_path: str) -> List[Issue]:
+    """
+    scan_file runs the blacklists and signatures of a session over a file of a checkout.
+    :return: a list of findings if any.
+    """
+    if session.blacklist_matcher.match(file_path=rel_path, extension=os.path.splitext(rel_path)[1].lstrip(".")):
+        return []
+
+    try:
+        with open(os.path.join(root, rel_path), mode="rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size > MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return _scan_content(session, rel_path, data)
+            return _scan_content(session, rel_path, f.read())
+    except OSError as e:
+        logger.warning("Skipped %s: %s", rel_path, e)
+        return []
+
+
+def _scan_content(session: Session, rel_path: str, data: Union[bytes, mmap.mmap]) -> List[Issue]:
+    lines = iter_lines(data) if b"\0" not in data[:BINARY_SNIFF] else iter(())
+    return [hit for hit in scan_file_lines(session, rel_path, lines) if hit]
+
+
+def iter_files(root: str) -> Iterator[str]:
+    """
+    iter_files walks a checkout, leaving out git's own files and symlinks.
+    :returns: the path of each file, relative to the root and separated by "/".
+    """
+    for directory, directories, files in os.walk(root):
+        directories[:] = sorted(d for d in directories if d != ".git")
+        rel_directory = os.path.relpath(directory, root).replace(os.sep, "/")
+        for name in sorted(files):
+            if os.path.islink(os.path.join(directory, name)):
+                continue
+            yield name if rel_directory == "." else f"{rel_directory}/{name}"
+
+
+# session compiled once by each worker process
+_WORKER_SESSION: Optional[Session] = None
+
+
+def _init_worker(config_content: str):
+    global _WORKER_SESSION
+    _WORKER_SESSION = Session(config_content=config_content)
+
+
+def _scan_in_worker(root: str, rel_path: str) -> List[Issue]:
+    return scan_file(_WORKER_SESSION, root, rel_path)
+
+
+def scan_repository(root: str, config_content: str, workers: Optional[int] = None) -> Tuple[int, List[Issue]]:
+    """
+    scan_repository scans every file of a local checkout, spread over a pool of worker processes that each compile
+    the config once. A single worker scans in this process.
+    :return: the number of files scanned and their findings.
+    """
+    workers = workers or os.cpu_count() or 1
+    paths = list(iter_files(root))
+
+    if workers == 1:
+        session = Session(config_content=config_content)
+        results = [scan_file(session, root, rel_path) for rel_path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(config_content,)) as pool:
+            # files are sent in chunks so moving them between processes does not outweigh scanning them
+            chunk_size = max(1, min(256, len(paths) // (workers * 4)))
+            results = list(pool.map(_scan_in_worker, [root] * len(paths), paths, chunksize=chunk_size))
+
+    return len(paths), [hit for hits in results for hit in hits]
@@ -0,0 +1,145 @@
+import json
+import logging
+import os
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+from .blacklists import BlacklistItem, Extension, Path
+from .signatures import EntropySignature, PatternSignature, Signature, SimpleSignature
+
+logger = logging.getLogger(__name__)
+
+# bumped whenever the layout of a ruleset, or the analysis it stores, changes
+RULESET_VERSION = 3
+
+
+def dump_ruleset(
+    fingerprint: str,
+    signatures: List[Signature],
+    blacklists: List[BlacklistItem],
+    plan: Dict[int, Tuple[Optional[List[str]], bool]],
+    fragments: Dict[int, Optional[str]],
+    reject_unsafe: bool = True,
+) -> Dict[str, Any]:
+    """
+    dump_ruleset turns what a session compiled from a config into a JSON-friendly ruleset: the signatures and
+    blacklists that loaded, normalised, and the analysis of their regexes. Regex validity and analysis can differ
+    between Python versions, so rulesets are tied to the version that compiled them, and to whether signatures prone
+    to catastrophic backtracking were left out.
+    """
+    return {
+        "version": RULESET_VERSION,
+        "python": list(sys.version_info[:2]),
+        "fingerprint": fingerprint,
+        "reject_unsafe": reject_unsafe,
+        "signatures": [_dump_signature(sig) for sig in signatures],
+        "blacklists": [
+            {"type": BlacklistItem.Types.EXTENSION.value, "text": item.text}
+            if isinstance(item, Extension)
+            else {"type": BlacklistItem.Types.PATH.value, "text": item.pattern}
+            for item in blacklists
+        ],
+        "plan": {str(index): [literals, buffered] for index, (literals, buffered) in plan.items()},
+        "fragments": {str(index): fragment for index, fragment in fragments.items()},
+    }
+
+
+def _dump_signature(sig: Signature) -> Dict[str, Any]:
+    if isinstance(sig, SimpleSignature):
+        return {"type": Signature.TYPE_SIMPLE, "part": sig.part, "name": sig.name, "match": sig.to_match}
+    if isinstance(sig, EntropySignature):
+        return {
+            "type": Signature.TYPE_ENTROPY,
+            "part": sig.part,
+            "name": sig.name,
+            "threshold": sig.threshold,
+            "charset": sig.charset,
+            "min_length": sig.min_length,
+        }
+    return {"type": Signature.TYPE_PATTERN, "part": sig.part, "name": sig.name, "regex": sig.regex.pattern}
+
+
+def load_ruleset(
+    ruleset: Dict[str, Any]
+) -> Tuple[List[Signature], List[BlacklistItem], Dict[int, Tuple[Optional[List[str]], bool]], Dict[int, Optional[str]]]:
+    """
+    load_ruleset builds back the signatures, blacklists and regex analysis stored in a ruleset.
+    """
+    signatures: List[Signature] = []
+    for sig in ruleset["signatures"]:
+        if sig["type"] == Signature.TYPE_SIMPLE:
+            signatures.append(SimpleSignature(name=sig["name"], part=sig["part"], match=sig["match"]))
+        elif sig["type"] == Signature.TYPE_ENTROPY:
+            signatures.append(
+                EntropySignature(
+                    name=sig["name"],
+                    part=sig["part"],
+                    threshold=sig["threshold"],
+                    charset=sig["charset"],
+                    min_length=sig["min_length"],
+                )
+            )
+        else:
+            signatures.append(PatternSignature(name=sig["name"], part=sig["part"], regex=sig["regex"]))
+
+    blacklists: List[BlacklistItem] = [
+        Extension(text=item["text"]) if item["type"] == BlacklistItem.Types.EXTENSION.value else Path(text=item["text"])
+        for item in ruleset["blacklists"]
+    ]
+
+    plan = {int(index): (literals, buffered) for index, (literals, buffered) in ruleset["plan"].items()}
+    fragments = {int(index): fragment for index, fragment in ruleset["fragments"].items()}
+    return signatures, blacklists, plan, fragments
+
+
+class RulesetCache:
+    """
+    Directory of compiled rulesets, one JSON file per config fingerprint, so a config is only parsed and analysed
+    once across processes and restarts. Rulesets written by another version of shhbt or of Python are ignored.
+    Without a directory, nothing is cached.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+
+    def path(self, fingerprint: str) -> Optional[str]:
+        if not self.directory:
+            return None
+        return os.path.join(self.directory, f"{fingerprint}.json")
+
+    def load(self, fingerprint: str, reject_unsafe: bool = True) -> Optional[Dict[str, Any]]:
+        path = self.path(fingerprint)
+        if path is None or not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, mode="r") as f:
+                ruleset = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable ruleset %s: %s", path, e)
+            return None
+
+        if (
+            ruleset.get("version") != RULESET_VERSION
+            or ruleset.get("python") != list(sys.version_info[:2])
+            or ruleset.get("fingerprint") != fingerprint
+            or ruleset.get("reject_unsafe") != reject_unsafe
+        ):
+            return None
+        return ruleset
+
+    def store(self, ruleset: Dict[str, Any]):
+        path = self.path(ruleset["fingerprint"])
+        if path is None:
+            return
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # written aside then moved in place, so readers never see half a ruleset
+            fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, mode="w") as f:
+                json.dump(ruleset, f)
+            os.replace(temporary, path)
+        except OSError as e:
+            logger.warning("Could not store ruleset %s: %s", path, e)
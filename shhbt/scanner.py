@@ -0,0 +1,251 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor
+from os.path import splitext
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from shhbt.data import Issue
+from shhbt.metrics import HITS, METRICS, new_counters
+from shhbt.session import Session
+from shhbt.signatures import Budget
+from shhbt.utils import iter_additions
+
+if TYPE_CHECKING:
+    # process pools take a while to import, and scanning a diff from the command line does not need them
+    from concurrent.futures import ProcessPoolExecutor
+
+
+# seconds each content signature may spend on a file, 0 for no limit
+SIGNATURE_BUDGET = float(os.getenv("SIGNATURE_BUDGET", "5"))
+
+
+def scan_file_change(session: Session, new_path: str, content: str) -> List[Optional[Issue]]:
+    """
+    scan_file_change runs the blacklists and signatures of a session over the diff of one file.
+    :return: a list of findings if any, or a list with a single None if the file is blacklisted.
+    """
+    return scan_file_lines(session, new_path, iter_additions(text=content))
+
+
+def scan_file_lines(session: Session, new_path: str, lines: Iterable[Tuple[int, str]]) -> List[Optional[Issue]]:
+    """
+    scan_file_lines runs the blacklists and signatures of a session over the numbered lines of one file. Lines are
+    only read if the file is not blacklisted. Content signatures that take longer than SIGNATURE_BUDGET seconds on
+    the file are aborted, and reported as such.
+    :return: a list of findings if any, or a list with a single None if the file is blacklisted.
+    """
+    name_splits = new_path.split("/")
+    filename = name_splits[len(name_splits) - 1]
+    # extract extension from filename. Index 1 should be the extension
+    extension = splitext(filename)[1].lstrip(".")
+
+    if session.blacklist_matcher.match(file_path=new_path, extension=extension):
+        return [None]
+
+    counters = {} if METRICS.enabled else None
+    budget = Budget(SIGNATURE_BUDGET) if SIGNATURE_BUDGET > 0 else None
+    content_hits = session.content_matcher.scan(lines, counters, budget)
+    aborted = budget.aborted if budget is not None else set()
+    file_hits = session.file_matcher.match(path=new_path, filename=filename, extension=extension)
+    if counters is not None:
+        for index in file_hits:
+            counters.setdefault(index, new_counters())[HITS] += 1
+        METRICS.add(session, counters)
+
+    hits: List[Issue] = []
+
+    # findings are reported in the order signatures were declared in
+    for index in sorted(content_hits.keys() | set(file_hits) | aborted):
+        signature = session.signatures[index]
+        if signature.part == signature.PART_CONTENTS:
+            for line_number, nr_findings in content_hits.get(index, ()):
+                hits.append(
+                    Issue(
+                        nr_findings=nr_findings,
+                        signature_name=signature.name,
+                        file_rel_path=new_path,
+                        line_number=line_number,
+                    )
+                )
+            if index in aborted:
+                hits.append(Issue(nr_findings=0, signature_name=signature.name, file_rel_path=new_path, aborted=True))
+        else:
+            hits.append(Issue(nr_findings=1, file_rel_path=new_path, signature_name=signature.name))
+
+    return hits
+
+
+# sessions compiled inside a worker process, by config fingerprint
+_WORKER_SESSIONS: "OrderedDict[str, Session]" = OrderedDict()
+_WORKER_SESSIONS_SIZE = 8
+
+
+def _scan_batch(
+    fingerprint: str, config_content: Optional[str], changes: List[Tuple[str, str]], measure: bool = False
+) -> Optional[Tuple[List[List[Optional[Issue]]], Optional[Dict[int, List[float]]]]]:
+    """
+    _scan_batch runs in a worker process. It scans a batch of changes with the session of the given fingerprint,
+    compiling it from config_content the first time. Returns None when the worker does not have that session yet and
+    no config was sent along.
+    :return: the findings of each change, and the signature metrics of the batch if asked to measure it.
+    """
+    session = _WORKER_SESSIONS.get(fingerprint)
+    if session is None:
+        if config_content is None:
+            return None
+        session = _WORKER_SESSIONS[fingerprint] = Session(config_content=config_content)
+        while len(_WORKER_SESSIONS) > _WORKER_SESSIONS_SIZE:
+            _WORKER_SESSIONS.popitem(last=False)
+    _WORKER_SESSIONS.move_to_end(fingerprint)
+
+    # the worker only measures when the process that sent the batch does, and hands its metrics back
+    METRICS.enabled = measure
+    hits = [scan_file_change(session, new_path, content) for new_path, content in changes]
+    return hits, METRICS.drain(fingerprint) if measure else None
+
+
+def iter_batches(changes: Iterable[Tuple[str, str]], batch_bytes: int) -> Iterator[List[Tuple[str, str]]]:
+    """
+    iter_batches groups changes into batches of about batch_bytes of diff, as the changes arrive.
+    """
+    batch: List[Tuple[str, str]] = []
+    size = 0
+    for change in changes:
+        batch.append(change)
+        size += len(change[1] or "")
+        if size >= batch_bytes:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+class ProcessScanner:
+    """
+    Long-lived pool of worker processes scanning file changes outside the GIL. Compiled sessions never travel:
+    each batch names the session it needs by fingerprint, and a worker that does not hold it yet gets the raw config
+    once and keeps the compiled session for the next batches. Changes are sent in batches of about batch_bytes of
+    diff, to amortise the cost of moving them between processes.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._pool: Optional["ProcessPoolExecutor"] = None
+
+    def _executor(self) -> "ProcessPoolExecutor":
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def submit(self, session: Session, changes: List[Tuple[str, str]]) -> Callable[[], List[List[Optional[Issue]]]]:
+        """
+        submit hands a batch of changes to the workers, and returns a function that waits for their findings.
+        """
+        try:
+            pool = self._executor()
+            measure = METRICS.enabled
+            future = pool.submit(_scan_batch, session.fingerprint, None, changes, measure)
+        except BrokenExecutor:
+            self.shutdown()
+            raise
+
+        def result() -> List[List[Optional[Issue]]]:
+            try:
+                scanned = future.result()
+                if scanned is None:
+                    scanned = pool.submit(
+                        _scan_batch, session.fingerprint, session.config_content, changes, measure
+                    ).result()
+            except BrokenExecutor:
+                # a worker died, start afresh on the next scan
+                self.shutdown()
+                raise
+            hits, counters = scanned
+            if counters:
+                # metrics measured in the workers are added up in this process
+                METRICS.add(session, counters)
+            return hits
+
+        return result
+
+    def scan(
+        self, session: Session, changes: Iterable[Tuple[str, str]], batch_bytes: int = 256 * 1024
+    ) -> List[List[Optional[Issue]]]:
+        """
+        scan returns the findings of each change, in the order the changes were given.
+        """
+        pending = [self.submit(session, batch) for batch in iter_batches(changes, batch_bytes)]
+        return [hits for result in pending for hits in result()]
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        # pending batches can only be cancelled from Python 3.9
+        if sys.version_info >= (3, 9):
+            pool.shutdown(wait=False, cancel_futures=True)
+        else:
+            pool.shutdown(wait=False)
+
+
+_PROCESS_SCANNERS: Dict[int, ProcessScanner] = {}
+_PROCESS_SCANNERS_LOCK = threading.Lock()
+
+
+def process_scanner(workers: int) -> ProcessScanner:
+    """
+    process_scanner returns the process-wide scanner with the given number of workers, creating it on first use.
+    """
+    with _PROCESS_SCANNERS_LOCK:
+        scanner = _PROCESS_SCANNERS.get(workers)
+        if scanner is None:
+            scanner = _PROCESS_SCANNERS[workers] = ProcessScanner(workers=workers)
+        return scanner
+
+
+_THREAD_EXECUTORS: Dict[Tuple[str, int], ThreadPoolExecutor] = {}
+_THREAD_EXECUTORS_LOCK = threading.Lock()
+
+
+def thread_executor(threads: int, name: str = "scan") -> ThreadPoolExecutor:
+    """
+    thread_executor returns the process-wide executor with the given name and number of threads, creating it on first
+    use. Every event runs its work on them, so the number of threads does not grow with the number of concurrent
+    events.
+    """
+    with _THREAD_EXECUTORS_LOCK:
+        executor = _THREAD_EXECUTORS.get((name, threads))
+        if executor is None:
+            executor = _THREAD_EXECUTORS[(name, threads)] = ThreadPoolExecutor(
+                max_workers=threads, thread_name_prefix=f"shhbt-{name}"
+            )
+        return executor
+
+
+def shutdown_scanners():
+    """
+    shutdown_scanners shuts down every process-wide scanner and executor, waiting for the threads to finish their work.
+    They are created afresh if asked for again.
+    """
+    with _PROCESS_SCANNERS_LOCK:
+        scanners = list(_PROCESS_SCANNERS.values())
+        _PROCESS_SCANNERS.clear()
+    with _THREAD_EXECUTORS_LOCK:
+        executors = list(_THREAD_EXECUTORS.values())
+        _THREAD_EXECUTORS.clear()
+
+    for scanner in scanners:
+        scanner.shutdown()
+    for executor in executors:
+        executor.shutdown(wait=True)
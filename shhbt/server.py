@@ -1,8 +1,38 @@
+import atexit
 import os
+from typing import Optional
 
-from flask import Flask, Response, request
+from flask import Flask, Response, jsonify, request
 
 from shhbt.gitclient.gitlab import handle_gitlab_event
+from shhbt.metrics import METRICS
+from shhbt.scanner import shutdown_scanners
+from shhbt.session import ConfigWatcher
+from shhbt.workers import EventQueue
+
+
+def _setting(app: Flask, name: str, default):
+    """
+    _setting reads a setting from the app config, falling back to an environment variable of the same name.
+    """
+    value = app.config.get(name, os.getenv(name))
+    if value is None:
+        return default
+    if isinstance(default, bool) and isinstance(value, str):
+        return value.lower() in ("1", "true", "yes")
+    return type(default)(value)
+
+
+def shutdown_app(app: Flask, timeout: Optional[float] = None):
+    """
+    shutdown_app drains the events queued by an app, then shuts down the scanners and executors they ran on. WSGI
+    servers should call it as a worker exits, e.g. from gunicorn's `worker_exit` hook. It's otherwise only run as the
+    interpreter exits, when the executors may no longer take work.
+    """
+    events = app.extensions.get("shhbt_events")
+    if events is not None:
+        events.shutdown(timeout=timeout)
+    shutdown_scanners()
 
 
 def create_flask_app(config=None):
@@ -11,15 +41,55 @@ def create_flask_app(config=None):
     if config is not None:
         app.config.update(config)
 
+    # the default config is compiled once here and shared by every request, it's only rebuilt when the file changes
+    default_config = ConfigWatcher(location=app.config.get("CONFIG_LOCATION"))
+    if app.config.get("CONFIG_LOCATION") or os.getenv("CONFIG_LOCATION"):
+        default_config.get()
+
+    # per signature cost and hits, measured by every scan of the process once enabled
+    if _setting(app, "SIGNATURE_METRICS", False):
+        METRICS.enabled = True
+
+    events = None
+    if _setting(app, "ASYNC_EVENTS", False):
+        events = EventQueue(
+            handler=lambda event: handle_gitlab_event(event, default_config=default_config),
+            workers=_setting(app, "EVENT_WORKERS", 4),
+            max_size=_setting(app, "EVENT_QUEUE_SIZE", 100),
+        )
+        events.start()
+        # a fallback for servers that exit without calling shutdown_app
+        atexit.register(shutdown_app, app)
+    app.extensions["shhbt_events"] = events
+
     @app.route("/", methods=["POST"])
     def handle_hook():
         if request.headers.get("X-Gitlab-Event") is not None:
             req = request.get_json()
 
             if req.get("event_type") == "merge_request":
-                handle_gitlab_event(req)
-                return Response(status=200)
+                if events is None:
+                    handle_gitlab_event(req, default_config=default_config)
+                    return Response(status=200)
+
+                if events.submit(req):
+                    return Response(status=202)
+                return Response(status=503, headers={"Retry-After": "30"})
 
         return Response(status=400)
 
+    @app.route("/queue", methods=["GET"])
+    def queue_status():
+        if events is None:
+            return Response(status=404)
+
+        return jsonify(depth=events.depth, max_size=events.max_size, workers=events.workers)
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        if not METRICS.enabled:
+            return Response(status=404)
+
+        return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
     return app
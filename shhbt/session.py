@@ -1,22 +1,86 @@
+import hashlib
 import logging
-from typing import Dict, List
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 from re import error as RegexError
 
-import yaml
+from .blacklists import BlacklistItem, BlacklistMatcher, Extension, Path
+from .metrics import METRICS
+from .ruleset import RulesetCache, dump_ruleset, load_ruleset
+from .signatures import (
+    ContentMatcher,
+    EntropySignature,
+    FileMatcher,
+    Signature,
+    SimpleSignature,
+    PatternSignature,
+    backtracking_risk,
+)
 
-from .blacklists import BlacklistItem, Extension, Path
-from .signatures import Signature, SimpleSignature, PatternSignature
+
+def config_fingerprint(config_content: str) -> str:
+    return hashlib.sha256(config_content.encode("utf-8")).hexdigest()
+
+
+# compiled rulesets, by config fingerprint, kept in the RULESET_CACHE directory if set
+RULESETS = RulesetCache(directory=os.getenv("RULESET_CACHE"))
+# regex signatures prone to catastrophic backtracking are left out, unless set to "warn"
+UNSAFE_SIGNATURES = os.getenv("UNSAFE_SIGNATURES", "reject")
 
 
 class Session:
-    def __init__(self, config_content):
+    def __init__(self, config_content, rulesets: Optional[RulesetCache] = None, reject_unsafe: Optional[bool] = None):
         self._logger = logging.getLogger(__name__ + "." + self.__module__.split(".")[-1])
-        self._config = self._load_config(config_content)
-        self.signatures = self._parse_signatures()
-        self.blacklists = self._parse_blacklists()
+        self.reject_unsafe = UNSAFE_SIGNATURES != "warn" if reject_unsafe is None else reject_unsafe
+        if hasattr(config_content, "read"):
+            config_content = config_content.read()
+        self.config_content = config_content
+        self.fingerprint = config_fingerprint(config_content)
+
+        # a ruleset compiled from the same config skips parsing it and analysing its regexes
+        rulesets = rulesets or RULESETS
+        ruleset = rulesets.load(self.fingerprint, self.reject_unsafe)
+        if ruleset is not None:
+            self.signatures, self.blacklists, plan, fragments = load_ruleset(ruleset)
+        else:
+            self._config = self._load_config(config_content)
+            self.signatures = self._parse_signatures()
+            self.blacklists = self._parse_blacklists()
+            plan, fragments = None, None
+
+        self.blacklist_matcher = BlacklistMatcher(self.blacklists)
+        self.content_matcher = self._build_content_matcher(plan)
+        self.file_matcher = self._build_file_matcher(fragments)
+
+        if ruleset is None:
+            rulesets.store(self.ruleset())
+
+    def ruleset(self) -> Dict:
+        """
+        ruleset returns the compiled form of this session, that later sessions of the same config can load from.
+        """
+        return dump_ruleset(
+            self.fingerprint,
+            self.signatures,
+            self.blacklists,
+            self.content_matcher.plan,
+            self.file_matcher.fragments,
+            self.reject_unsafe,
+        )
 
     def _load_config(self, contents) -> Dict:
-        return yaml.safe_load(contents)
+        # imported here, sessions loaded from a compiled ruleset never need it
+        import yaml
+
+        try:
+            # libyaml parses configs several times faster, when it's available
+            from yaml import CSafeLoader as SafeLoader
+        except ImportError:  # pragma: no cover
+            from yaml import SafeLoader
+
+        return yaml.load(contents, Loader=SafeLoader)  # nosec - always a safe loader
 
     def _parse_signatures(self) -> List[Signature]:
         signatures = []
@@ -30,17 +94,38 @@ class Session:
                         match=signature.get("match"),
                     )
                 )
-            else:
+            elif signature.get("entropy") is not None:
                 try:
                     signatures.append(
-                        PatternSignature(
+                        EntropySignature(
                             name=signature.get("name"),
                             part=signature.get("part"),
-                            regex=signature.get("regex"),
+                            threshold=signature.get("entropy"),
+                            charset=signature.get("charset", "base64"),
+                            min_length=signature.get("min_length", 20),
                         )
                     )
+                except (AttributeError, TypeError, ValueError):
+                    self._logger.exception("Failed loading signature. Offending entry: %s", signature)
+            else:
+                try:
+                    pattern = PatternSignature(
+                        name=signature.get("name"),
+                        part=signature.get("part"),
+                        regex=signature.get("regex"),
+                    )
                 except RegexError:
                     self._logger.exception("Failed loading signature. Offending entry: %s", signature)
+                    continue
+
+                # any repository can ship a config, and one such regex can keep a worker busy for minutes
+                risk = backtracking_risk(pattern.regex)
+                if risk is not None:
+                    if self.reject_unsafe:
+                        self._logger.warning("Rejected signature with %s. Offending entry: %s", risk, signature)
+                        continue
+                    self._logger.warning("Signature with %s may backtrack catastrophically: %s", risk, signature)
+                signatures.append(pattern)
         return signatures
 
     def _parse_blacklists(self) -> List[BlacklistItem]:
@@ -53,3 +138,113 @@ class Session:
             blacklist.append(Path(text=item))
 
         return blacklist
+
+    def _build_content_matcher(self, plan=None) -> ContentMatcher:
+        return ContentMatcher(
+            [(index, sig) for index, sig in enumerate(self.signatures) if sig.part == Signature.PART_CONTENTS], plan
+        )
+
+    def _build_file_matcher(self, fragments=None) -> FileMatcher:
+        return FileMatcher(
+            [(index, sig) for index, sig in enumerate(self.signatures) if sig.part != Signature.PART_CONTENTS],
+            fragments,
+        )
+
+
+class SessionCache:
+    """
+    Process-wide LRU of compiled Sessions keyed by the hash of their config content, so every repository shipping
+    the same config shares a single compiled ruleset. Once it holds max_size sessions, the least recently used one
+    is evicted, along with its signature metrics.
+    """
+
+    def __init__(self, max_size: int = 64):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, config_content: str) -> Session:
+        key = config_fingerprint(config_content)
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+                self.hits += 1
+                return session
+            self.misses += 1
+
+        session = Session(config_content=config_content)
+
+        evicted = []
+        with self._lock:
+            # another thread may have compiled the same config meanwhile, keep the first one
+            session = self._sessions.setdefault(key, session)
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_size:
+                evicted.append(self._sessions.popitem(last=False)[0])
+
+        for fingerprint in evicted:
+            METRICS.forget(fingerprint)
+        return session
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._sessions), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+SESSION_CACHE = SessionCache(max_size=int(os.getenv("SESSION_CACHE_SIZE", "64")))
+
+
+class ConfigWatcher:
+    """
+    Keeps the Session compiled from a config file in memory so every event can share it read-only. The file is only
+    parsed again when its modification time or size change, and the Session is only rebuilt when its content hash
+    does. The location defaults to the CONFIG_LOCATION environment variable.
+    """
+
+    def __init__(self, location: Optional[str] = None):
+        self._location = location
+        self._lock = threading.Lock()
+        # (location, mtime, size), content digest and the session built from it, swapped as a whole
+        self._state: Optional[Tuple[Tuple[str, int, int], str, Session]] = None
+
+    @property
+    def location(self) -> str:
+        return self._location or os.getenv("CONFIG_LOCATION", "NOT_THIS_ONE")
+
+    def get(self) -> Session:
+        location = self.location
+        stat = os.stat(location)
+        key = (location, stat.st_mtime_ns, stat.st_size)
+
+        state = self._state
+        if state is not None and state[0] == key:
+            return state[2]
+
+        with self._lock:
+            state = self._state
+            if state is not None and state[0] == key:
+                return state[2]
+
+            with open(file=location, mode="r") as f:
+                content = f.read()
+            digest = config_fingerprint(content)
+
+            if state is not None and state[0][0] == location and state[1] == digest:
+                session = state[2]
+            else:
+                session = SESSION_CACHE.get(content)
+            self._state = (key, digest, session)
+
+        return session
@@ -1,12 +1,29 @@
+import codecs
+import math
+import os
 import re
+import string
+import time
 
 from abc import ABC, abstractmethod
-from typing import Tuple, List
+from bisect import bisect_right
+from collections import Counter
+from re import error as RegexError
+from typing import Dict, Iterable, List, Optional, Pattern, Sequence, Set, Tuple
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # pragma: no cover - Python < 3.11
+    import sre_constants
+    import sre_parse
+
+from shhbt.metrics import BYTES, CALLS, HITS, SECONDS, new_counters
 
 
 class Signature(ABC):
     TYPE_SIMPLE = "simple"
     TYPE_PATTERN = "pattern"
+    TYPE_ENTROPY = "entropy"
 
     PART_EXTENSION = "extension"
     PART_FILENAME = "filename"
@@ -92,3 +109,1076 @@ class PatternSignature(Signature):
             matches.append(str(match[0]))
 
         return matches
+
+
+# characters that cannot be encoded become NUL, one for each, which no charset holds
+codecs.register_error("shhbt-nul", lambda error: ("\x00" * (error.end - error.start), error.end))
+
+
+class EntropySignature(Signature):
+    """
+    Signature for random-looking tokens with no known shape: runs of at least min_length characters of a charset
+    whose Shannon entropy, in bits per character, is above a threshold. Charsets are given by name (base64,
+    base64url or hex), or as the characters themselves. Runs are found with substring searches over the whole
+    content, and their characters counted by C code, so none is looked at in Python: with collections.Counter for a
+    few runs, and with NumPy, imported on first use, for larger batches.
+    """
+
+    CHARSETS = {
+        "base64": string.ascii_letters + string.digits + "+/=",
+        "base64url": string.ascii_letters + string.digits + "-_=",
+        "hex": string.hexdigits,
+    }
+    # runs longer than this are encoded blobs rather than secrets, and left out
+    MAX_LENGTH = 1024
+    # entropies are worked out for this many runs at a time, to bound the memory it takes
+    BATCH = 4096
+    # batches of fewer runs than this are counted one run at a time, cheaper than the fixed cost of NumPy calls
+    VECTORISED = 16
+    # c * log2(c) for every count of a character in a run, 0 for none
+    _C_LOG2_C = [0.0] + [count * math.log2(count) for count in range(1, MAX_LENGTH + 1)]
+
+    def __init__(self, threshold: float, *args, charset: str = "base64", min_length: int = 20, **kwargs):
+        super().__init__(*args, **kwargs)
+        charset = self.CHARSETS.get(charset, charset or "")
+        if (
+            self.part != self.PART_CONTENTS
+            or not charset.isascii()
+            or not charset.isprintable()
+            or any(char.isspace() for char in charset)
+        ):
+            raise AttributeError("Invalid signature in config")
+        self.charset = "".join(sorted(set(charset)))
+        self.min_length = int(min_length)
+        self.threshold = float(threshold)
+        if not self.charset or self.min_length < 2:
+            raise AttributeError("Invalid signature in config")
+        # a table mapping the characters of the charset to 1 and the rest to 0
+        self._member = bytes(1 if chr(code) in self.charset else 0 for code in range(256))
+        # a run of n characters has an entropy of at most log2(n), so shorter runs can never be above the threshold
+        self._run = b"\x01" * max(self.min_length, int(2 ** min(self.threshold, 11)) + 1)
+        self._lookup = None
+
+    def match(self, path: str, filename: str, extension: str, content: str) -> Tuple[bool, str]:
+        if self.part != self.PART_CONTENTS:
+            return False, ""
+        return len(self.get_content_matches(content)) > 0, self.PART_CONTENTS
+
+    def get_content_matches(self, content: str) -> List[str]:
+        raw, starts, lengths = self.candidates(content)
+        matches = []
+        for batch in range(0, len(starts), self.BATCH):
+            batch_starts = starts[batch : batch + self.BATCH]
+            batch_lengths = lengths[batch : batch + self.BATCH]
+            for row in self.above(raw, batch_starts, batch_lengths):
+                matches.append(content[batch_starts[row] : batch_starts[row] + batch_lengths[row]])
+
+        return matches
+
+    def candidates(self, content: str) -> Tuple[bytes, List[int], List[int]]:
+        """
+        candidates finds the runs of the charset long enough to be checked.
+        :return: the characters of the content as bytes, those beyond Latin-1 as NUL, and the offset and length of
+        every run.
+        """
+        # one byte per character keeps offsets in line with the content
+        raw = content.encode("ascii") if content.isascii() else content.encode("latin-1", "shhbt-nul")
+
+        # runs too short to be checked are skipped over by substring searches, rather than looked at one by one
+        inside = raw.translate(self._member)
+        starts = []
+        lengths = []
+        start = inside.find(self._run)
+        while start >= 0:
+            end = inside.find(b"\x00", start)
+            if end < 0:
+                end = len(inside)
+            if end - start <= self.MAX_LENGTH:
+                starts.append(start)
+                lengths.append(end - start)
+            start = inside.find(self._run, end)
+
+        return raw, starts, lengths
+
+    def above(self, raw: bytes, starts: Sequence[int], lengths: Sequence[int]) -> List[int]:
+        """
+        above tells which of the given runs have an entropy above the threshold.
+        :return: their positions in starts.
+        """
+        return [row for row, entropy in enumerate(self.entropies(raw, starts, lengths)) if entropy > self.threshold]
+
+    def entropies(self, raw: bytes, starts: Sequence[int], lengths: Sequence[int]) -> Sequence[float]:
+        """
+        entropies works out the Shannon entropy, H = (n * log2(n) - sum(c * log2(c))) / n, of each of the given runs
+        of n characters, from the counts c of their characters.
+        """
+        table = self._C_LOG2_C
+        if len(starts) < self.VECTORISED:
+            return [
+                (table[length] - sum(map(table.__getitem__, Counter(raw[start : start + length]).values()))) / length
+                for start, length in zip(starts, lengths)
+            ]
+
+        # the characters of every run are counted at once, in a row of the charset per run
+        import numpy as np
+
+        if self._lookup is None:
+            self._lookup = np.zeros(256, dtype=np.intp)
+            self._lookup[[ord(char) for char in self.charset]] = np.arange(len(self.charset))
+        size = len(self.charset)
+        table = np.array(table)
+        starts = np.array(starts, dtype=np.intp)
+        lengths = np.array(lengths, dtype=np.intp)
+        ends = lengths.cumsum()
+        offsets = np.arange(ends[-1]) + (starts - ends + lengths).repeat(lengths)
+        symbols = self._lookup.take(np.frombuffer(raw, dtype=np.uint8).take(offsets))
+        rows = np.arange(0, len(starts) * size, size).repeat(lengths)
+        counts = np.bincount(rows + symbols, minlength=len(starts) * size)
+        return (table.take(lengths) - table.take(counts).reshape(-1, size).sum(axis=1)) / lengths
+
+
+_GLOBAL_FLAGS = re.compile(r"^\(\?([aiLmsux]+)\)")
+_UNCOMBINABLE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+
+
+class CombinedPattern:
+    """
+    One alternation over the regexes of many signatures, so a single search tells whether any of them matches.
+    Only when it does are the other members searched again, from the leftmost match onwards, to report every one
+    that fires. Regexes that cannot be safely wrapped in a group are searched on their own.
+    """
+
+    def __init__(
+        self,
+        signatures: Sequence[Tuple[int, "PatternSignature"]],
+        fragments: Optional[Dict[int, Optional[str]]] = None,
+    ):
+        self._groups: Dict[str, int] = {}
+        self._members: List[Tuple[int, Pattern]] = []
+        self._standalone: List[Tuple[int, Pattern]] = []
+        self._combined: Optional[Pattern] = None
+        # the group each signature takes in the alternation, None for those searched on their own, so a compiled
+        # ruleset can skip working them out again
+        self.fragments: Dict[int, Optional[str]] = {}
+        known = fragments or {}
+
+        for index, signature in signatures:
+            fragment = known[index] if index in known else self._fragment(index, signature.regex)
+            self.fragments[index] = fragment
+            if fragment is None:
+                self._standalone.append((index, signature.regex))
+            else:
+                self._groups[f"s{index}"] = index
+                self._members.append((index, signature.regex))
+
+        combinable = [fragment for fragment in self.fragments.values() if fragment is not None]
+        if combinable:
+            try:
+                self._combined = re.compile("|".join(combinable))
+            except RegexError:
+                self._standalone.extend(self._members)
+                self._members = []
+
+    @staticmethod
+    def _fragment(index: int, regex: Pattern) -> Optional[str]:
+        pattern = regex.pattern
+        if regex.groupindex or _UNCOMBINABLE.search(pattern):
+            return None
+
+        flags = _GLOBAL_FLAGS.match(pattern)
+        if flags is not None:
+            pattern = f"(?{flags.group(1)}:{pattern[flags.end():]})"
+
+        fragment = f"(?P<s{index}>{pattern})"
+        try:
+            re.compile(fragment)
+        except RegexError:
+            return None
+        return fragment
+
+    def search_all(self, haystack: str) -> List[int]:
+        """
+        search_all returns the indexes of every signature whose regex is found in the haystack.
+        """
+        fired = [index for index, regex in self._standalone if regex.search(haystack) is not None]
+
+        if self._combined is not None:
+            match = self._combined.search(haystack)
+            if match is not None:
+                first = self._groups[match.lastgroup]
+                fired.append(first)
+                # nothing matches before the leftmost match, so the others only need to be searched from there on
+                fired.extend(
+                    index
+                    for index, regex in self._members
+                    if index != first and regex.search(haystack, match.start()) is not None
+                )
+
+        return fired
+
+
+class FileMatcher:
+    """
+    Index built once per session over every extension, filename and path signature. Simple signatures are looked up
+    by the exact value of their part, and pattern signatures are grouped into one CombinedPattern per part, so a
+    file costs a dict lookup and a single search per part.
+    """
+
+    PARTS = (Signature.PART_EXTENSION, Signature.PART_FILENAME, Signature.PART_PATH)
+
+    def __init__(
+        self, signatures: Sequence[Tuple[int, Signature]], fragments: Optional[Dict[int, Optional[str]]] = None
+    ):
+        self._exact: Dict[str, Dict[str, List[int]]] = {part: {} for part in self.PARTS}
+        self._patterns: Dict[str, CombinedPattern] = {}
+        self._generic: List[Tuple[int, Signature]] = []
+        patterns: Dict[str, List[Tuple[int, PatternSignature]]] = {part: [] for part in self.PARTS}
+
+        for index, signature in signatures:
+            if signature.part not in self.PARTS:
+                if not isinstance(signature, (SimpleSignature, PatternSignature)):
+                    self._generic.append((index, signature))
+            elif isinstance(signature, SimpleSignature):
+                self._exact[signature.part].setdefault(signature.to_match, []).append(index)
+            elif isinstance(signature, PatternSignature):
+                patterns[signature.part].append((index, signature))
+            else:
+                self._generic.append((index, signature))
+
+        for part, part_signatures in patterns.items():
+            if part_signatures:
+                self._patterns[part] = CombinedPattern(part_signatures, fragments)
+
+    @property
+    def fragments(self) -> Dict[int, Optional[str]]:
+        return {index: fragment for pattern in self._patterns.values() for index, fragment in pattern.fragments.items()}
+
+    def match(self, path: str, filename: str, extension: str) -> List[int]:
+        """
+        match returns the sorted indexes of the signatures that fire for the given file.
+        """
+        haystacks = {
+            Signature.PART_EXTENSION: extension,
+            Signature.PART_FILENAME: filename,
+            Signature.PART_PATH: path,
+        }
+        fired = []
+
+        for part, haystack in haystacks.items():
+            fired.extend(self._exact[part].get(haystack, ()))
+            combined = self._patterns.get(part)
+            if combined is not None:
+                fired.extend(combined.search_all(haystack))
+
+        for index, signature in self._generic:
+            if signature.match(path=path, filename=filename, extension=extension, content="")[0]:
+                fired.append(index)
+
+        return sorted(fired)
+
+
+# Character classes that, when present in a set, make it match a newline.
+_NEWLINE_CATEGORIES = {
+    sre_constants.CATEGORY_SPACE,
+    sre_constants.CATEGORY_NOT_DIGIT,
+    sre_constants.CATEGORY_NOT_WORD,
+    sre_constants.CATEGORY_LINEBREAK,
+}
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, getattr(sre_constants, "POSSESSIVE_REPEAT", None)}
+_NEWLINE = ord("\n")
+
+
+def _set_matches_newline(items) -> bool:
+    negate = False
+    matched = False
+    for op, av in items:
+        if op is sre_constants.NEGATE:
+            negate = True
+        elif op is sre_constants.LITERAL:
+            matched = matched or av == _NEWLINE
+        elif op is sre_constants.RANGE:
+            matched = matched or av[0] <= _NEWLINE <= av[1]
+        elif op is sre_constants.CATEGORY:
+            matched = matched or av in _NEWLINE_CATEGORIES
+        else:
+            return True
+    return matched != negate
+
+
+def _is_line_bounded(subpattern, flags: int) -> bool:
+    """
+    _is_line_bounded tells whether a parsed regex can never match a newline nor depend on what surrounds a line.
+    Such patterns produce exactly the same matches over a newline-joined buffer as they do line by line.
+    """
+    for op, av in subpattern:
+        if op is sre_constants.LITERAL:
+            if av == _NEWLINE:
+                return False
+        elif op is sre_constants.NOT_LITERAL:
+            if av != _NEWLINE:
+                return False
+        elif op is sre_constants.ANY:
+            if flags & sre_constants.SRE_FLAG_DOTALL:
+                return False
+        elif op is sre_constants.IN:
+            if _set_matches_newline(av):
+                return False
+        elif op is sre_constants.SUBPATTERN:
+            _, add_flags, del_flags, sub = av
+            if not _is_line_bounded(sub, (flags | add_flags) & ~del_flags):
+                return False
+        elif op in _REPEATS:
+            if not _is_line_bounded(av[2], flags):
+                return False
+        elif op is sre_constants.BRANCH:
+            if not all(_is_line_bounded(branch, flags) for branch in av[1]):
+                return False
+        elif op is getattr(sre_constants, "ATOMIC_GROUP", None):
+            if not _is_line_bounded(av, flags):
+                return False
+        elif op is sre_constants.AT:
+            # word boundaries treat a newline exactly like the start or the end of a line
+            if av not in (sre_constants.AT_BOUNDARY, sre_constants.AT_NON_BOUNDARY):
+                return False
+        else:
+            # anchors, lookarounds and back references depend on the surroundings of a line
+            return False
+    return True
+
+
+def can_scan_buffered(regex: Pattern) -> bool:
+    """
+    can_scan_buffered returns True when the regex can be run once over many newline-joined lines and still produce
+    the very same matches it would produce running line by line.
+    """
+    parsed = sre_parse.parse(regex.pattern, regex.flags)
+    return parsed.getwidth()[0] > 0 and _is_line_bounded(parsed, parsed.state.flags)
+
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: re.compile(r"\d"),
+    sre_constants.CATEGORY_NOT_DIGIT: re.compile(r"\D"),
+    sre_constants.CATEGORY_SPACE: re.compile(r"\s"),
+    sre_constants.CATEGORY_NOT_SPACE: re.compile(r"\S"),
+    sre_constants.CATEGORY_WORD: re.compile(r"\w"),
+    sre_constants.CATEGORY_NOT_WORD: re.compile(r"\W"),
+}
+
+
+def _same_char(code: int, char: str, flags: int) -> bool:
+    if flags & sre_constants.SRE_FLAG_IGNORECASE:
+        return chr(code).lower() == char.lower()
+    return chr(code) == char
+
+
+def _char_matches(op, av, char: str, flags: int) -> bool:
+    """
+    _char_matches tells whether a parsed single character item may match the given character, True when unsure.
+    """
+    if op is sre_constants.LITERAL:
+        return _same_char(av, char, flags)
+    if op is sre_constants.NOT_LITERAL:
+        return not _same_char(av, char, flags)
+    if op is sre_constants.ANY:
+        return char != "\n" or bool(flags & sre_constants.SRE_FLAG_DOTALL)
+    if op is sre_constants.IN:
+        negate = False
+        matched = False
+        chars = {char, char.lower(), char.upper()} if flags & sre_constants.SRE_FLAG_IGNORECASE else {char}
+        for item_op, item_av in av:
+            if item_op is sre_constants.NEGATE:
+                negate = True
+            elif item_op is sre_constants.LITERAL:
+                matched = matched or _same_char(item_av, char, flags)
+            elif item_op is sre_constants.RANGE:
+                matched = matched or any(item_av[0] <= ord(c) <= item_av[1] for c in chars)
+            elif item_op is sre_constants.CATEGORY and item_av in _CATEGORIES:
+                matched = matched or _CATEGORIES[item_av].match(char) is not None
+            else:
+                return True
+        return matched != negate
+    return True
+
+
+def _consumed(subpattern, flags: int, items: List[Tuple]) -> bool:
+    """
+    _consumed gathers every single character item of a parsed sequence, with the flags they are matched with.
+    Returns False when the sequence holds something else that consumes characters, such as a back reference.
+    """
+    for op, av in subpattern:
+        if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN):
+            items.append((op, av, flags))
+        elif op is sre_constants.SUBPATTERN:
+            if not _consumed(av[-1], (flags | av[1]) & ~av[2], items):
+                return False
+        elif op in _REPEATS:
+            if not _consumed(av[2], flags, items):
+                return False
+        elif op is sre_constants.BRANCH:
+            if not all(_consumed(branch, flags, items) for branch in av[1]):
+                return False
+        elif op is getattr(sre_constants, "ATOMIC_GROUP", None):
+            if not _consumed(av, flags, items):
+                return False
+        elif op not in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            return False
+    return True
+
+
+def _mandatory(subpattern, flags: int):
+    """
+    _mandatory yields the single character items every match of a parsed sequence goes through, with their flags.
+    """
+    for op, av in subpattern:
+        if op is sre_constants.LITERAL or op is sre_constants.IN:
+            yield op, av, flags
+        elif op is sre_constants.SUBPATTERN:
+            yield from _mandatory(av[-1], (flags | av[1]) & ~av[2])
+
+
+def _first(subpattern, flags: int):
+    """
+    _first returns the first single character item of a parsed sequence with its flags, or None if unsure what it is.
+    """
+    for op, av in subpattern:
+        if op in (sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN):
+            return op, av, flags
+        if op is sre_constants.SUBPATTERN:
+            return _first(av[-1], (flags | av[1]) & ~av[2])
+        if op is not sre_constants.AT:
+            return None
+    return None
+
+
+# stands for an empty alternative, which only overlaps with another empty one
+_EMPTY = (None, None, 0)
+
+
+def _overlap(first, second) -> bool:
+    """
+    _overlap tells whether two single character items may match the same character, True when unsure.
+    """
+    if first is _EMPTY or second is _EMPTY:
+        return first is second
+    if first is None or second is None:
+        return True
+    for (op, av, flags), other in ((first, second), (second, first)):
+        if op is sre_constants.LITERAL:
+            return _char_matches(other[0], other[1], chr(av), other[2])
+        if op is sre_constants.IN and all(item_op is sre_constants.LITERAL for item_op, _ in av):
+            return any(_char_matches(other[0], other[1], chr(code), other[2]) for _, code in av)
+    return True
+
+
+_MANY_REPEATS = 10
+
+
+def _backtracking_risk(subpattern, flags: int) -> Optional[str]:
+    for op, av in subpattern:
+        if op is sre_constants.SUBPATTERN:
+            children = [(av[-1], (flags | av[1]) & ~av[2])]
+        elif op in _REPEATS:
+            children = [(av[2], flags)]
+        elif op is sre_constants.BRANCH:
+            children = [(branch, flags) for branch in av[1]]
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            children = [(av[1], flags)]
+        elif op is getattr(sre_constants, "ATOMIC_GROUP", None):
+            # atomic groups never backtrack into themselves
+            continue
+        else:
+            continue
+
+        # a handful of repeats only ever costs a polynomial amount of backtracking
+        if op in _REPEATS and av[1] >= _MANY_REPEATS and op is not getattr(sre_constants, "POSSESSIVE_REPEAT", None):
+            risk = _repeated_risk(av[2], flags)
+            if risk is not None:
+                return risk
+
+        for child, child_flags in children:
+            risk = _backtracking_risk(child, child_flags)
+            if risk is not None:
+                return risk
+    return None
+
+
+def _repeated_risk(body, flags: int) -> Optional[str]:
+    """
+    _repeated_risk looks for the ways the body of an unbounded repeat can match the same text in many ways.
+    """
+    # an inner repeat of variable length, not held apart by a character it cannot match, splits a run of text
+    # in exponentially many ways: (a+)+, (\w+\s?)*
+    inner_repeats = []
+    _variable_repeats(body, flags, inner_repeats)
+    delimiters = list(_mandatory(body, flags))
+    for inner, inner_flags in inner_repeats:
+        consumed: List[Tuple] = []
+        if not _consumed(inner, inner_flags, consumed):
+            return "nested quantifiers"
+        held_apart = any(
+            op is sre_constants.LITERAL
+            and not any(_char_matches(c_op, c_av, chr(av), c_flags) for c_op, c_av, c_flags in consumed)
+            for op, av, _ in delimiters
+        )
+        if not held_apart:
+            return "nested quantifiers"
+
+    # so do alternatives that can start the same way: (?:a|a)*, (\w+|[0-9]x)*. An empty alternative starts the way
+    # what follows it does, which is the body again when nothing does: (a|aa)+ is parsed as (a(?:|a))+
+    branches: List[Tuple] = []
+    _top_level_branches(body, flags, branches, _first(body, flags))
+    for alternatives, branch_flags, follow in branches:
+        empty = _EMPTY if follow is None else follow
+        firsts = [_first(branch, branch_flags) if len(branch) else empty for branch in alternatives]
+        for position, first in enumerate(firsts):
+            if any(_overlap(first, other) for other in firsts[position + 1 :]):
+                return "overlapping alternatives under a quantifier"
+    return None
+
+
+def _top_level_branches(subpattern, flags: int, found: List[Tuple], after):
+    """
+    _top_level_branches collects the alternatives of a parsed sequence that are not under a repeat of their own, with
+    their flags and the first single character item that follows them, given the one that follows the sequence.
+    """
+    items = list(subpattern)
+    for position, (op, av) in enumerate(items):
+        rest = items[position + 1 :]
+        follow = _first(rest, flags) if rest else after
+        if op is sre_constants.BRANCH:
+            found.append((av[1], flags, follow))
+        elif op is sre_constants.SUBPATTERN:
+            _top_level_branches(av[-1], (flags | av[1]) & ~av[2], found, follow)
+
+
+def _variable_repeats(subpattern, flags: int, found: List[Tuple]):
+    for op, av in subpattern:
+        if op in _REPEATS:
+            if av[1] > 1 and av[1] != av[0]:
+                found.append((av[2], flags))
+            else:
+                _variable_repeats(av[2], flags, found)
+        elif op is sre_constants.SUBPATTERN:
+            _variable_repeats(av[-1], (flags | av[1]) & ~av[2], found)
+        elif op is sre_constants.BRANCH:
+            for branch in av[1]:
+                _variable_repeats(branch, flags, found)
+
+
+def backtracking_risk(regex: Pattern) -> Optional[str]:
+    """
+    backtracking_risk looks for the shapes of regex that can take exponential time to fail on a long enough input:
+    a repeated group holding a repeat of its own, or repeated alternatives that can match the same text.
+    :return: the shape found, or None if the regex has none of them.
+    """
+    parsed = sre_parse.parse(regex.pattern, regex.flags)
+    return _backtracking_risk(parsed, parsed.state.flags)
+
+
+_MIN_LITERAL_LENGTH = 3
+# ASCII case folding, plus the non-ASCII characters that re.IGNORECASE matches against ASCII letters
+_CASE_FOLDS = str.maketrans(
+    {
+        **{upper: upper.lower() for upper in string.ascii_uppercase},
+        "\u0130": "i",
+        "\u0131": "i",
+        "\u017f": "s",
+        "\u212a": "k",
+    }
+)
+_MAX_LITERAL_COMBINATIONS = 32
+
+
+def _exact_strings(op, av):
+    """
+    _exact_strings returns the finite set of strings a single parsed item matches, or None when it is not small and
+    exactly known.
+    """
+    if op is sre_constants.LITERAL:
+        return {chr(av)}
+    if op is sre_constants.IN:
+        if len(av) <= 8 and all(item_op is sre_constants.LITERAL for item_op, _ in av):
+            return {chr(code) for _, code in av}
+        return None
+    if op is sre_constants.SUBPATTERN:
+        return _exact_sequence(av[-1])
+    if op is sre_constants.BRANCH:
+        strings = set()
+        for branch in av[1]:
+            exact = _exact_sequence(branch)
+            if exact is None:
+                return None
+            strings |= exact
+        return strings if len(strings) <= _MAX_LITERAL_COMBINATIONS else None
+    return None
+
+
+def _exact_sequence(subpattern):
+    strings = {""}
+    for op, av in subpattern:
+        exact = _exact_strings(op, av)
+        if exact is None or len(strings) * len(exact) > _MAX_LITERAL_COMBINATIONS:
+            return None
+        strings = {prefix + suffix for prefix in strings for suffix in exact}
+    return strings
+
+
+def _literal_score(literals):
+    return (min(len(literal) for literal in literals), -len(literals))
+
+
+def _required(subpattern):
+    """
+    _required walks a parsed sequence and returns the most selective set of literals such that any match of the
+    sequence contains at least one of them, or None if there is no such set.
+    """
+    best = None
+    candidates = []
+    run = None
+
+    for op, av in subpattern:
+        exact = _exact_strings(op, av)
+        if exact is not None:
+            if run is not None and len(run) * len(exact) <= _MAX_LITERAL_COMBINATIONS:
+                run = {prefix + suffix for prefix in run for suffix in exact}
+            else:
+                candidates.append(run)
+                run = exact
+            continue
+
+        candidates.append(run)
+        run = None
+        if op is sre_constants.SUBPATTERN:
+            candidates.append(_required(av[-1]))
+        elif op in _REPEATS and av[0] >= 1:
+            candidates.append(_required(av[2]))
+        elif op is getattr(sre_constants, "ATOMIC_GROUP", None):
+            candidates.append(_required(av))
+        elif op is sre_constants.BRANCH:
+            branches = [_required(branch) for branch in av[1]]
+            if all(branches):
+                candidates.append(set().union(*branches))
+    candidates.append(run)
+
+    for literals in candidates:
+        if literals and (best is None or _literal_score(literals) > _literal_score(best)):
+            best = literals
+    return best
+
+
+def required_literals(regex: Pattern) -> Optional[List[str]]:
+    """
+    required_literals extracts from a regex a list of literals where at least one always shows up in any of its
+    matches. Returns None if the regex has no ASCII literal long enough to be worth filtering on.
+    """
+    literals = _required(sre_parse.parse(regex.pattern, regex.flags))
+    if not literals or min(len(literal) for literal in literals) < _MIN_LITERAL_LENGTH:
+        return None
+    if not all(literal.isascii() and "\n" not in literal for literal in literals):
+        return None
+    return sorted(literals)
+
+
+class LiteralPrefilter:
+    """
+    Multi-string matcher over the required literals of many signatures. Each distinct literal is looked up once in a
+    case-folded copy of the whole buffer, so text without any of them is rejected with a handful of linear substring
+    searches, and only the lines holding a literal are mapped to the signatures worth running.
+    """
+
+    def __init__(self, literals: Dict[int, Sequence[str]]):
+        self._owners: Dict[str, Set[int]] = {}
+        for index, signature_literals in literals.items():
+            for literal in signature_literals:
+                self._owners.setdefault(literal.lower(), set()).add(index)
+
+    def scan(self, buffer: str, starts: Sequence[int]) -> Dict[int, List[int]]:
+        """
+        scan looks for the literals in a newline-joined buffer whose lines begin at the given offsets.
+        :return: for each signature index with a literal in the buffer, the numbers of the lines it showed up in.
+        """
+        # literals are matched ignoring case, which is never less than what their regex accepts
+        folded = buffer.lower() if buffer.isascii() else buffer.translate(_CASE_FOLDS)
+        found: Dict[int, Set[int]] = {}
+
+        for literal, owners in self._owners.items():
+            position = folded.find(literal)
+            if position < 0:
+                continue
+
+            line_nrs = set()
+            while position >= 0:
+                line_nr = bisect_right(starts, position) - 1
+                line_nrs.add(line_nr)
+                if line_nr + 1 == len(starts):
+                    break
+                position = folded.find(literal, starts[line_nr + 1])
+
+            for index in owners:
+                found.setdefault(index, set()).update(line_nrs)
+
+        return {index: sorted(line_nrs) for index, line_nrs in found.items()}
+
+
+class ContentMatcher:
+    """
+    Matcher built once per session over every `contents` signature, so a file change is scanned in a single pass
+    instead of once per signature and per added line.
+    Signatures with required literals sit behind a LiteralPrefilter and only run on the lines holding one of them.
+    Of the rest, patterns that can never span a line are run once over all added lines joined together, and the
+    remaining ones fall back to a line by line scan. Entropy signatures also run over all added lines at once, and
+    work out the entropy of all their candidate tokens in batches. Results are indexed by the position of the signature
+    in the session.
+    Lines longer than LONG_LINE, such as minified bundles or inline blobs, are scanned on their own, in windows of that
+    size overlapping by the longest match a signature can have, so the cost of any one search stays bounded.
+    """
+
+    # added lines are buffered and scanned in chunks of about this many characters
+    CHUNK_SIZE = 1 << 20
+    # lines longer than this are scanned in windows of this many characters
+    LONG_LINE = int(os.getenv("LONG_LINE_THRESHOLD", str(64 * 1024)))
+    # and skipped altogether if they look like minified code, when set
+    SKIP_MINIFIED = os.getenv("SKIP_MINIFIED_LINES", "").lower() in ("1", "true", "yes")
+    # windows never overlap by more than this, or half their size, even for signatures without a bound on their length
+    MAX_OVERLAP = 4096
+
+    def __init__(
+        self,
+        signatures: Sequence[Tuple[int, Signature]],
+        plan: Optional[Dict[int, Tuple[Optional[List[str]], bool]]] = None,
+    ):
+        self._gated: Dict[int, Signature] = {}
+        self._buffered: List[Tuple[int, Pattern]] = []
+        self._per_line: List[Tuple[int, Signature]] = []
+        self._entropy: List[Tuple[int, EntropySignature]] = []
+        # the required literals of each pattern and whether it can be scanned buffered, so a compiled ruleset can
+        # skip analysing them again
+        self.plan: Dict[int, Tuple[Optional[List[str]], bool]] = {}
+        literals: Dict[int, List[str]] = {}
+        known = plan or {}
+
+        for index, signature in signatures:
+            if isinstance(signature, PatternSignature):
+                if index in known:
+                    required, buffered = known[index]
+                else:
+                    required = required_literals(signature.regex)
+                    buffered = not required and can_scan_buffered(signature.regex)
+                self.plan[index] = (required, buffered)
+                if required:
+                    literals[index] = required
+                    self._gated[index] = signature
+                    continue
+                if buffered:
+                    self._buffered.append((index, signature.regex))
+                    continue
+            elif isinstance(signature, EntropySignature):
+                self._entropy.append((index, signature))
+                continue
+            self._per_line.append((index, signature))
+
+        self.prefilter = LiteralPrefilter(literals) if literals else None
+        self._overlap: Optional[int] = None
+
+    @property
+    def overlap(self) -> int:
+        """
+        overlap is the length of the longest match any signature can have, up to MAX_OVERLAP, worked out on the first
+        long line.
+        """
+        if self._overlap is None:
+            regexes = [regex for _, regex in self._buffered] + [sig.regex for sig in self._gated.values()]
+            regexes += [sig.regex for _, sig in self._per_line if isinstance(sig, PatternSignature)]
+            widths = [sre_parse.parse(regex.pattern, regex.flags).getwidth()[1] for regex in regexes]
+            self._overlap = min(max(widths, default=0), self.MAX_OVERLAP)
+        return self._overlap
+
+    def scan(
+        self,
+        lines: Iterable[Tuple[int, str]],
+        counters: Optional[Dict[int, List[float]]] = None,
+        budget: Optional["Budget"] = None,
+    ) -> Dict[int, List[Tuple[int, int]]]:
+        """
+        scan runs every content signature over the given numbered lines, consuming them in bounded chunks.
+        When given counters, the calls, time, characters and matches of each signature evaluated are added to them.
+        When given a budget, signatures that run out of it stop being evaluated, and are left in its aborted set.
+        :return: for each signature index that fired, the line number and number of matches of each line it matched,
+        in line order.
+        """
+        hits: Dict[int, List[Tuple[int, int]]] = {}
+        chunk: List[Tuple[int, str]] = []
+        size = 0
+
+        for numbered_line in lines:
+            if len(numbered_line[1]) > self.LONG_LINE:
+                # lines before it are scanned first, so matches stay in line order
+                if chunk:
+                    self._scan_chunk(chunk, hits, counters, budget)
+                    chunk = []
+                    size = 0
+                self._scan_long_line(numbered_line, hits, counters, budget)
+                continue
+
+            chunk.append(numbered_line)
+            size += len(numbered_line[1]) + 1
+            if size >= self.CHUNK_SIZE:
+                self._scan_chunk(chunk, hits, counters, budget)
+                chunk = []
+                size = 0
+
+        if chunk:
+            self._scan_chunk(chunk, hits, counters, budget)
+
+        return hits
+
+    def _scan_chunk(
+        self,
+        chunk: List[Tuple[int, str]],
+        hits: Dict[int, List[Tuple[int, int]]],
+        counters: Optional[Dict[int, List[float]]] = None,
+        budget: Optional["Budget"] = None,
+    ):
+        lines = [line for _, line in chunk]
+        buffer = "\n".join(lines)
+        starts = []
+        offset = 0
+        for line in lines:
+            starts.append(offset)
+            offset += len(line) + 1
+        timed = counters is not None or budget is not None
+
+        if self.prefilter is not None:
+            for index, rows in self.prefilter.scan(buffer, starts).items():
+                if budget is not None and index in budget.aborted:
+                    continue
+                signature = self._gated[index]
+                started = time.thread_time() if timed else 0
+                deadline = budget.deadline(index, started) if budget is not None else None
+                calls = size = found = 0
+                for row in rows:
+                    if deadline is not None and time.thread_time() > deadline:
+                        break
+                    calls += 1
+                    size += len(lines[row])
+                    matches = signature.get_content_matches(lines[row])
+                    if matches:
+                        hits.setdefault(index, []).append((chunk[row][0], len(matches)))
+                        found += len(matches)
+                if timed:
+                    self._account(counters, budget, index, started, calls, size, found, cut=calls < len(rows))
+
+        for index, regex in self._buffered:
+            if budget is not None and index in budget.aborted:
+                continue
+            started = time.thread_time() if timed else 0
+            deadline = budget.deadline(index, started) if budget is not None else None
+            found = 0
+            cut = False
+            last_row = -1
+            for match in regex.finditer(buffer):
+                found += 1
+                row = bisect_right(starts, match.start()) - 1
+                if row == last_row:
+                    line_nr, count = hits[index][-1]
+                    hits[index][-1] = (line_nr, count + 1)
+                else:
+                    hits.setdefault(index, []).append((chunk[row][0], 1))
+                    last_row = row
+                if deadline is not None and time.thread_time() > deadline:
+                    cut = True
+                    break
+            if timed:
+                self._account(counters, budget, index, started, 1, len(buffer), found, cut)
+
+        for index, signature in self._entropy:
+            if budget is not None and index in budget.aborted:
+                continue
+            started = time.thread_time() if timed else 0
+            deadline = budget.deadline(index, started) if budget is not None else None
+            found = 0
+            cut = False
+            last_row = -1
+            raw, token_starts, lengths = signature.candidates(buffer)
+            for batch in range(0, len(token_starts), signature.BATCH):
+                if deadline is not None and time.thread_time() > deadline:
+                    cut = True
+                    break
+                batch_starts = token_starts[batch : batch + signature.BATCH]
+                for position in signature.above(raw, batch_starts, lengths[batch : batch + signature.BATCH]):
+                    found += 1
+                    row = bisect_right(starts, batch_starts[position]) - 1
+                    if row == last_row:
+                        line_nr, count = hits[index][-1]
+                        hits[index][-1] = (line_nr, count + 1)
+                    else:
+                        hits.setdefault(index, []).append((chunk[row][0], 1))
+                        last_row = row
+            if timed:
+                self._account(counters, budget, index, started, 1, len(buffer), found, cut)
+
+        for index, signature in self._per_line:
+            if budget is not None and index in budget.aborted:
+                continue
+            started = time.thread_time() if timed else 0
+            deadline = budget.deadline(index, started) if budget is not None else None
+            calls = size = found = 0
+            for line_nr, line in chunk:
+                if deadline is not None and time.thread_time() > deadline:
+                    break
+                calls += 1
+                size += len(line)
+                matches = signature.get_content_matches(line)
+                if matches:
+                    hits.setdefault(index, []).append((line_nr, len(matches)))
+                    found += len(matches)
+            if timed:
+                self._account(counters, budget, index, started, calls, size, found, cut=calls < len(chunk))
+
+    def _scan_long_line(
+        self,
+        numbered_line: Tuple[int, str],
+        hits: Dict[int, List[Tuple[int, int]]],
+        counters: Optional[Dict[int, List[float]]] = None,
+        budget: Optional["Budget"] = None,
+    ):
+        """
+        _scan_long_line runs every content signature over a long line, a window at a time. Windows overlap by the
+        longest match a signature can have, and each match is only counted in the window it starts before the next
+        one, so a secret across the edge of two windows is found exactly once. Searches see the line before the window,
+        and pick up after the last match counted, so matches are counted as a search over the whole line would.
+        Matches running past the point where the next window takes over are tried again up to the end of the next
+        window, so anchors and lookarounds see the line beyond the window, while each search stays bounded. A match
+        still running at that point is taken to run to the end of the line.
+        """
+        line_nr, line = numbered_line
+        if self.SKIP_MINIFIED and looks_minified(line):
+            return
+
+        regexes: List[Tuple[int, Pattern, bool]] = [(index, regex, False) for index, regex in self._buffered]
+        regexes += [(index, signature.regex, True) for index, signature in self._gated.items()]
+        regexes.sort()
+        whole = []
+        for index, signature in self._per_line:
+            if isinstance(signature, PatternSignature):
+                regexes.append((index, signature.regex, False))
+            else:
+                whole.append((index, signature))
+        # entropy signatures leave out tokens longer than MAX_LENGTH, so they take bounded memory over any line
+        whole += self._entropy
+
+        window = self.LONG_LINE
+        # windows never overlap by more than half, so a low threshold costs at most twice a scan of the line
+        stride = max(window - min(self.overlap, window // 2), 1)
+        found: Dict[int, int] = {}
+        # where the last match counted for each signature ends
+        counted: Dict[int, int] = {}
+        timed = counters is not None or budget is not None
+
+        for start in range(0, len(line), stride):
+            end = min(start + window, len(line))
+            # matches starting further on are found again, whole, in the next window
+            keep_before = end if end == len(line) else start + stride
+            # and matches running past it are tried again up to the end of the next window, at most
+            limit = min(end + stride, len(line))
+            candidates = self.prefilter.scan(line[start:end], [0]) if self.prefilter is not None else {}
+
+            for index, regex, gated in regexes:
+                if (gated and index not in candidates) or (budget is not None and index in budget.aborted):
+                    continue
+                started = time.thread_time() if timed else 0
+                deadline = budget.deadline(index, started) if budget is not None else None
+                count = 0
+                # matches are searched for after the last one counted, as they would be over the whole line
+                position = max(start, counted.get(index, 0))
+                while position < keep_before:
+                    match = regex.search(line, position, end)
+                    if match is None or match.start() >= keep_before:
+                        break
+                    if end < len(line) and match.end() > keep_before:
+                        # near the end of the window, anchors, word boundaries and lookaheads see the end of the line
+                        # where it isn't, so the match is tried again further on
+                        found_at = match.start()
+                        match = regex.match(line, found_at, limit)
+                        if match is None:
+                            position = found_at + 1
+                            continue
+                    count += 1
+                    # one still running at the limit is taken to run to the end of the line, as over minified code
+                    position = len(line) if match.end() == limit < len(line) else max(match.end(), match.start() + 1)
+                    counted[index] = position
+                if count:
+                    found[index] = found.get(index, 0) + count
+                if timed:
+                    cut = deadline is not None and time.thread_time() > deadline and end < len(line)
+                    self._account(counters, budget, index, started, 1, end - start, count, cut)
+
+            if end == len(line):
+                break
+
+        for index, signature in whole:
+            matches = signature.get_content_matches(line)
+            if matches:
+                found[index] = len(matches)
+
+        for index, count in found.items():
+            hits.setdefault(index, []).append((line_nr, count))
+
+    @staticmethod
+    def _account(
+        counters: Optional[Dict[int, List[float]]],
+        budget: Optional["Budget"],
+        index: int,
+        started: float,
+        calls: int,
+        size: int,
+        found: int,
+        cut: bool,
+    ):
+        elapsed = time.thread_time() - started
+        if budget is not None:
+            budget.spend(index, elapsed, cut)
+        if counters is not None:
+            values = counters.get(index)
+            if values is None:
+                values = counters[index] = new_counters()
+            values[CALLS] += calls
+            values[SECONDS] += elapsed
+            values[BYTES] += size
+            values[HITS] += found
+
+
+def looks_minified(line: str, sample: int = 4096) -> bool:
+    """
+    looks_minified tells whether a line looks like minified code, from its first characters: dense in punctuation,
+    with hardly any whitespace. Encoded blobs, which may well be secrets, have little punctuation and do not qualify.
+    """
+    head = line[:sample]
+    spaces = head.count(" ") + head.count("\t")
+    punctuation = sum(head.count(char) for char in ";,{}()=")
+    return spaces < len(head) * 0.05 and punctuation > len(head) * 0.05
+
+
+class Budget:
+    """
+    CPU time each content signature may spend scanning one file, as measured by the thread scanning it, so waiting on
+    other threads is not charged. A signature that runs out of it is aborted, and not evaluated again on that file.
+    Python's regex engine cannot be interrupted, so the budget is checked between lines, or between the matches of
+    signatures run over many lines at once: a single search can still overrun it.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.spent: Dict[int, float] = {}
+        self.aborted: Set[int] = set()
+
+    def deadline(self, index: int, now: float) -> float:
+        return now + self.seconds - self.spent.get(index, 0.0)
+
+    def spend(self, index: int, elapsed: float, cut: bool = False):
+        """
+        spend charges a signature for the time it took, aborting it if it had to be cut short.
+        """
+        self.spent[index] = self.spent.get(index, 0.0) + elapsed
+        if cut:
+            self.aborted.add(index)
@@ -1,11 +1,124 @@
-from typing import List, Optional
+import logging
+import re
+from typing import Iterator, List, Optional, Tuple
+
+# lines that carry an addition or start a hunk, the only ones the parser needs to look at
+_ADDITION_OR_HUNK = re.compile(r"^(?:\+.|@@).*", re.MULTILINE)
+_HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+# each file of a multi-file diff starts with a line like `diff --git a/path b/path`
+_FILE_DIFF_HEADER = re.compile(r"^diff ", re.MULTILINE)
+
+
+def _count_lines_starting_with(text: str, prefix: str, start: int, end: int) -> int:
+    """
+    _count_lines_starting_with counts the lines of text[start:end] that begin with prefix, start being a line start.
+    """
+    count = text.count("\n" + prefix, start, end)
+    if start < end and text.startswith(prefix, start):
+        count += 1
+    return count
+
+
+def iter_additions(text: str) -> Iterator[Tuple[int, str]]:
+    """
+    iter_additions lazily walks a unified diff and yields each added line, along with its line number in the new
+    version of the file. Hunk headers set the line numbers and `+++` file headers are skipped.
+    Lines in between additions are only counted, never copied, so the diff is not materialised again in memory.
+    """
+    if not text:
+        return
+
+    new_line = 1
+    hunk_end: Optional[int] = None
+    in_hunk = False
+    position = 0
+
+    for match in _ADDITION_OR_HUNK.finditer(text):
+        start = match.start()
+        # every line skipped since the last one is either removed, a "no newline" marker, or also in the new file
+        skipped = text.count("\n", position, start)
+        if skipped:
+            new_line += (
+                skipped
+                - _count_lines_starting_with(text, "-", position, start)
+                - _count_lines_starting_with(text, "\\", position, start)
+            )
+        position = match.end() + 1
+
+        line = match.group()
+        if line.startswith("@@"):
+            header = _HUNK_HEADER.match(line)
+            if header is not None:
+                new_line = int(header.group(1))
+                hunk_end = new_line + int(header.group(2) or 1)
+            else:
+                hunk_end = None
+            in_hunk = True
+            continue
+
+        if line.startswith("+++ ") and (not in_hunk or (hunk_end is not None and new_line >= hunk_end)):
+            continue
+
+        yield new_line, line
+        new_line += 1
 
 
 def extract_additions(text: str) -> List[Optional[str]]:
     """
     extract_additions takes a diff content and returns a list of only the additions of text, which are the only
     things we want this command to parse.
-    If no additions are found, it returns False, None. Otherwise, returns True, List.
+    If no additions are found, it returns an empty list.
     """
-    # take all addiions from diff but drop newlines
-    return [line for line in text.split("\n") if line.startswith("+") and len(line) > 1]
+    return [line for _, line in iter_additions(text)]
+
+
+def _new_path(header: str) -> Optional[str]:
+    """
+    _new_path reads the path of the new version of a file from the header of its diff, None if it was deleted.
+    """
+    git = header.startswith("diff --git ")
+    for line in header.split("\n"):
+        if line.startswith("+++ "):
+            path = line[4:].split("\t")[0].strip('"')
+            if path == "/dev/null":
+                return None
+            return path[2:] if git and path.startswith("b/") else path
+        if line.startswith("deleted file mode"):
+            return None
+
+    # binary files and mode changes have no `+++` line, their path is only in the `diff --git` line
+    if git:
+        first_line = header.split("\n", 1)[0]
+        return first_line[first_line.rfind(" b/") + 3 :]
+    return None
+
+
+def iter_file_diffs(text: str) -> Iterator[Tuple[str, str]]:
+    """
+    iter_file_diffs splits a diff of several files, like the output of `git diff`, into the diff of each file.
+    :returns: the path of each file that was not deleted, and the hunks of its diff.
+    """
+    starts = [match.start() for match in _FILE_DIFF_HEADER.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+
+    for start, end in zip(starts, starts[1:] + [len(text)]):
+        section = text[start:end]
+        hunks = section.find("\n@@")
+        path = _new_path(section if hunks == -1 else section[:hunks])
+        if path:
+            yield path, "" if hunks == -1 else section[hunks + 1 :]
+
+
+def configure_logging(level: int = logging.DEBUG):
+    """
+    configure_logging sends the logs of every module to stderr. It's left to the entry points, so importing shhbt
+    does not change the logging of the application importing it.
+    """
+    logger = logging.getLogger()
+    handler = logging.StreamHandler()
+    formatter = logging.Formatter("%(asctime)s %(name)-12s %(levelname)-8s %(message)s")
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+    logger.setLevel(level)
@@ -0,0 +1,84 @@
+import logging
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+_STOP = object()
+
+
+class EventQueue:
+    """
+    Bounded in-process queue of webhook events, drained by a pool of long-lived worker threads. It lets the webhook
+    endpoint answer as soon as an event is accepted, while the scan and the status updates happen in the background.
+    """
+
+    def __init__(self, handler: Callable[[Dict[str, Any]], None], workers: int = 4, max_size: int = 100):
+        if workers < 1 or max_size < 1:
+            raise ValueError("An event queue needs at least one worker and one slot.")
+
+        self._logger = logging.getLogger(__name__ + "." + self.__module__.split(".")[-1])
+        self._handler = handler
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_size)
+        self._threads: List[threading.Thread] = []
+        self._accepting = False
+        self._lock = threading.Lock()
+        self.workers = workers
+        self.max_size = max_size
+
+    @property
+    def depth(self) -> int:
+        """
+        depth is the number of events waiting for a worker.
+        """
+        return self._queue.qsize()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for nr in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"shhbt-events-{nr}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._accepting = True
+
+    def submit(self, event: Dict[str, Any]) -> bool:
+        """
+        submit enqueues an event without blocking.
+        :return: False if the queue is not accepting events or is full, True otherwise.
+        """
+        if not self._accepting:
+            return False
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._logger.warning("Event queue is full (%s events), rejecting event.", self.max_size)
+            return False
+        return True
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """
+        shutdown stops accepting new events and waits for the workers to drain the ones already queued.
+        """
+        with self._lock:
+            if not self._accepting:
+                return
+            self._accepting = False
+            # the stop markers queue up behind the pending events, so those still get handled
+            for _ in self._threads:
+                self._queue.put(_STOP)
+            for thread in self._threads:
+                thread.join(timeout=timeout)
+            self._threads = []
+
+    def _work(self):
+        while True:
+            event = self._queue.get()
+            try:
+                if event is _STOP:
+                    return
+                self._handler(event)
+            except Exception as e:
+                self._logger.exception("Failed handling queued event with error %s", e)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,49 @@
+from unittest import TestCase
+
+from benchmarks.corpus import generate_diffs
+from benchmarks.run import CONFIG, regressions
+from shhbt.scanner import scan_file_change
+from shhbt.session import Session
+
+
+class TestBenchmarkCorpus(TestCase):
+    def test_same_seed_same_diffs(self):
+        # GIVEN two corpora generated from the same seed, and one from another seed
+        first = generate_diffs(seed=7, files=20)
+        second = generate_diffs(seed=7, files=20)
+        other = generate_diffs(seed=8, files=20)
+
+        # THEN the first two are identical and the third one is not
+        assert first == second
+        assert first != other
+        assert len(first) == 20
+
+    def test_planted_secrets_and_blacklists_are_found(self):
+        # GIVEN a corpus where every file is blacklisted, and one where every added line holds a secret
+        with open(CONFIG) as f:
+            session = Session(config_content=f.read())
+        blacklisted = generate_diffs(seed=1, files=10, blacklist_ratio=1)
+        leaky = generate_diffs(seed=1, files=10, blacklist_ratio=0, secret_ratio=1)
+
+        # WHEN they are scanned with the shipped config
+        skipped = [scan_file_change(session, d["new_path"], d["diff"]) for d in blacklisted]
+        findings = [scan_file_change(session, d["new_path"], d["diff"]) for d in leaky]
+
+        # THEN blacklisted files are skipped and every file with additions leaks something
+        assert skipped == [[None]] * 10
+        assert all(hits for d, hits in zip(leaky, findings) if "\n+" in d["diff"])
+
+    def test_regressions_beyond_tolerance(self):
+        # GIVEN results slightly and much slower than their baselines, one faster, and one without a baseline
+        baselines = {"a/x": {"lines_per_s": 1000, "files_per_s": 100}, "b/x": {"lines_per_s": 1000}}
+        results = {
+            "a/x": {"lines_per_s": 900, "files_per_s": 50},
+            "b/x": {"lines_per_s": 2000},
+            "c/x": {"lines_per_s": 1},
+        }
+
+        # WHEN they are compared with a 25% tolerance
+        slower = regressions(results, baselines, tolerance=0.25)
+
+        # THEN only the metric that dropped beyond the tolerance is reported
+        assert slower == [("a/x", "files_per_s", 50, 100)]
@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from shhbt.blacklists import Extension, Path
+from shhbt.blacklists import BlacklistMatcher, Extension, Path
 
 
 class TestUtilsConfig(TestCase):
@@ -36,3 +36,42 @@ class TestUtilsConfig(TestCase):
 
         # THEN it should return False
         self.assertFalse(result)
+
+    def test_handles_separator_placeholders_and_dotted_extensions(self):
+        # GIVEN blacklist entries written like in the shipped config
+        path = Path(text="vendor{sep}bundle")
+        ext = Extension(text=".tar.gz")
+
+        # WHEN the match functions are called with files under those entries
+        # THEN they match, including paths relative to the repository root
+        self.assertTrue(path.match_item(file_path="vendor/bundle/ruby/x.rb", extension="rb"))
+        self.assertTrue(ext.match_item(file_path="dist/release.tar.gz", extension="gz"))
+
+        # BUT WHEN they are called with files that only look alike
+        # THEN they do not match
+        self.assertFalse(path.match_item(file_path="vendor/bundles/x.rb", extension="rb"))
+        self.assertFalse(ext.match_item(file_path="dist/release.gz", extension="gz"))
+
+    def test_blacklist_matcher_agrees_with_items(self):
+        # GIVEN a set of blacklist items
+        items = [Extension(text=".jpg"), Extension(text="tar.gz"), Path(text="node_modules{sep}"), Path(text="tests")]
+
+        # WHEN the matcher is built from them
+        matcher = BlacklistMatcher(items)
+        self.assertEqual({"jpg"}, matcher.extensions)
+
+        # THEN it skips exactly the files any of the items would skip
+        for file_path, extension in [
+            ("a/b.jpg", "jpg"),
+            ("a/b.tar.gz", "gz"),
+            ("node_modules/x/y.js", "js"),
+            ("a/tests/test_x.py", "py"),
+            ("a/notests/x.py", "py"),
+            ("tests.py", "py"),
+            ("a/b.png", "png"),
+        ]:
+            expected = any(item.match_item(file_path=file_path, extension=extension) for item in items)
+            self.assertEqual(expected, matcher.match(file_path=file_path, extension=extension), file_path)
+
+        # AND an empty blacklist never matches
+        self.assertFalse(BlacklistMatcher([]).match(file_path="a/b.jpg", extension="jpg"))
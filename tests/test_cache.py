@@ -0,0 +1,79 @@
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from shhbt.cache import RESULTS_VERSION, FileResultCache
+from shhbt.data import Issue
+from shhbt.signatures import ContentMatcher
+
+
+class TestFileResultCache(TestCase):
+    hits = [Issue(nr_findings=2, signature_name="Contains a private key", file_rel_path="a/b.txt")]
+
+    def test_keys_depend_on_path_diff_and_session(self):
+        key = FileResultCache.key("a/b.txt", "+diff", "fingerprint")
+
+        assert key == FileResultCache.key("a/b.txt", "+diff", "fingerprint")
+        assert key != FileResultCache.key("a/c.txt", "+diff", "fingerprint")
+        assert key != FileResultCache.key("a/b.txt", "+other diff", "fingerprint")
+        assert key != FileResultCache.key("a/b.txt", "+diff", "other fingerprint")
+
+    def test_keys_depend_on_the_scanner(self):
+        key = FileResultCache.key("a/b.txt", "+diff", "fingerprint")
+
+        # GIVEN settings that change how long lines are scanned, or a new version of the scanner
+        # THEN results kept before are not used
+        with patch.object(ContentMatcher, "LONG_LINE", 1024):
+            assert key != FileResultCache.key("a/b.txt", "+diff", "fingerprint")
+        with patch.object(ContentMatcher, "SKIP_MINIFIED", True):
+            assert key != FileResultCache.key("a/b.txt", "+diff", "fingerprint")
+        with patch("shhbt.cache.RESULTS_VERSION", RESULTS_VERSION + 1):
+            assert key != FileResultCache.key("a/b.txt", "+diff", "fingerprint")
+
+    def test_keeps_most_recently_used_results(self):
+        # GIVEN a cache that holds two results
+        cache = FileResultCache(max_size=2)
+
+        # WHEN a result is stored
+        cache.put("first", self.hits)
+
+        # THEN it can be read back
+        assert cache.get("first") == self.hits
+        assert cache.get("missing") is None
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # AND WHEN more results than it holds are stored
+        cache.put("second", [None])
+        cache.get("first")
+        cache.put("third", [])
+
+        # THEN the least recently used one is evicted
+        assert cache.get("second") is None
+        assert cache.get("first") == self.hits
+        assert cache.get("third") == []
+
+    def test_disabled_when_empty(self):
+        cache = FileResultCache(max_size=0)
+        cache.put("first", self.hits)
+
+        assert cache.get("first") is None
+
+    def test_persists_results_on_disk(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # GIVEN a cache backed by a database
+            cache = FileResultCache(path=f"{tmp_dir}/results.db")
+            cache.put("first", self.hits)
+            cache.put("blacklisted", [None])
+
+            # WHEN a new cache is opened over the same database
+            reopened = FileResultCache(path=f"{tmp_dir}/results.db")
+
+            # THEN the results are still there
+            assert reopened.get("first") == self.hits
+            assert reopened.get("blacklisted") == [None]
+
+            # AND WHEN it's cleared
+            reopened.clear()
+
+            # THEN they are gone
+            assert FileResultCache(path=f"{tmp_dir}/results.db").get("first") is None
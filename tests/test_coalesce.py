@@ -0,0 +1,89 @@
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+import pytest
+
+from shhbt.coalesce import EventCoalescer
+
+
+class TestEventCoalescer(TestCase):
+    def test_reuses_recent_results(self):
+        # GIVEN a coalescer and some work
+        coalescer = EventCoalescer(ttl=60)
+        calls = []
+
+        def work():
+            calls.append(1)
+            return len(calls)
+
+        # WHEN the same key is requested twice
+        # THEN the work only runs once
+        assert coalescer.run("key", work) == 1
+        assert coalescer.run("key", work) == 1
+        assert (coalescer.hits, coalescer.misses) == (1, 1)
+
+        # AND WHEN another key is requested
+        # THEN it runs again
+        assert coalescer.run("other", work) == 2
+
+    def test_results_expire(self):
+        # GIVEN a result stored at some point in time
+        coalescer = EventCoalescer(ttl=10)
+        with patch("shhbt.coalesce.time.monotonic", return_value=100):
+            coalescer.run("key", lambda: "first")
+
+        # WHEN it's requested again after its ttl
+        with patch("shhbt.coalesce.time.monotonic", return_value=111):
+            result = coalescer.run("key", lambda: "second")
+
+        # THEN the work runs again
+        assert result == "second"
+
+    def test_does_not_keep_uncacheable_results_or_errors(self):
+        coalescer = EventCoalescer(ttl=60)
+
+        # GIVEN work whose result should not be kept
+        assert coalescer.run("key", lambda: "failed", cacheable=lambda result: result != "failed") == "failed"
+
+        # THEN the next request runs it again
+        assert coalescer.run("key", lambda: "ok") == "ok"
+
+        # AND GIVEN work that raises
+        def fails():
+            raise RuntimeError("boom")
+
+        with pytest.raises(RuntimeError):
+            coalescer.run("other", fails)
+
+        # THEN the error is not kept either
+        assert coalescer.run("other", lambda: "ok") == "ok"
+
+    def test_collapses_in_flight_duplicates(self):
+        # GIVEN work that blocks until released
+        coalescer = EventCoalescer(ttl=0)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def work():
+            calls.append(1)
+            started.set()
+            release.wait(timeout=5)
+            return "verdict"
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(coalescer.run("key", work)))
+        leader.start()
+        started.wait(timeout=5)
+
+        # WHEN the same key is requested while it's running
+        follower = threading.Thread(target=lambda: results.append(coalescer.run("key", work)))
+        follower.start()
+        release.set()
+        leader.join(timeout=5)
+        follower.join(timeout=5)
+
+        # THEN both callers share a single run
+        assert results == ["verdict", "verdict"]
+        assert len(calls) == 1
@@ -1,10 +1,12 @@
 import os
+import shutil
+import tempfile
 from unittest import TestCase
 from unittest.mock import patch
 
 import pytest
 
-from shhbt.session import Session
+from shhbt.session import ConfigWatcher, Session, SessionCache
 
 
 class TestSession(TestCase):
@@ -56,3 +58,110 @@ class TestSession(TestCase):
             # THEN it should create 6 signatures
             assert session.signatures is not None
             assert len(session.signatures) == 6
+
+    def test_rejects_signatures_prone_to_catastrophic_backtracking(self):
+        # GIVEN a config with a regex that backtracks exponentially
+        config = (
+            "signatures:\n"
+            "  - {part: contents, regex: '(\\w+\\s?)+=', name: slow}\n"
+            "  - {part: contents, regex: 'AKIA[A-Z0-9]{16}', name: aws}\n"
+        )
+
+        # WHEN it is loaded
+        # THEN the signature is left out, unless told to only warn about it
+        assert [sig.name for sig in Session(config).signatures] == ["aws"]
+        assert [sig.name for sig in Session(config, reject_unsafe=False).signatures] == ["slow", "aws"]
+
+    def test_parses_entropy_signatures(self):
+        # GIVEN a config with entropy signatures, one of them with an invalid threshold
+        config = (
+            "signatures:\n"
+            "  - {part: contents, entropy: 3.5, charset: hex, min_length: 32, name: hex}\n"
+            "  - {part: contents, entropy: 4.5, name: base64}\n"
+            "  - {part: contents, entropy: high, name: broken}\n"
+            "  - {part: filename, entropy: 4.5, name: filename}\n"
+            "  - {part: contents, entropy: 4.5, charset: 'ab c', name: whitespace}\n"
+            "  - {part: contents, entropy: 4.5, min_length: 1, name: short}\n"
+        )
+
+        # WHEN it is loaded
+        signatures = Session(config).signatures
+
+        # THEN charsets are expanded, defaults applied and the invalid ones left out
+        assert [sig.name for sig in signatures] == ["hex", "base64"]
+        assert (signatures[0].charset, signatures[0].min_length, signatures[0].threshold) == (
+            "0123456789ABCDEFabcdef",
+            32,
+            3.5,
+        )
+        assert (len(signatures[1].charset), signatures[1].min_length) == (65, 20)
+
+    def test_watcher_rebuilds_session_only_when_file_changes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # GIVEN a config file watched for changes
+            location = f"{tmp_dir}/config.yaml"
+            shutil.copy(f"{self.test_dir_data}/config_with_sig.yaml", location)
+            watcher = ConfigWatcher(location=location)
+
+            # WHEN the session is requested twice
+            session = watcher.get()
+
+            # THEN it is compiled once and shared
+            assert len(session.signatures) == 6
+            assert watcher.get() is session
+
+            # AND WHEN the file is touched without changing its content
+            stat = os.stat(location)
+            os.utime(location, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+            # THEN the same session is kept
+            assert watcher.get() is session
+
+            # BUT WHEN its content changes
+            shutil.copy(f"{self.test_dir_data}/config_with_content_regex.yaml", location)
+            os.utime(location, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2_000_000_000))
+
+            # THEN a new session is swapped in
+            reloaded = watcher.get()
+            assert reloaded is not session
+            assert len(reloaded.signatures) == 1
+
+    def test_watcher_defaults_to_environment_location(self):
+        with patch.dict("os.environ", {"CONFIG_LOCATION": f"{self.test_dir_data}/config_with_sig.yaml"}):
+            # GIVEN a watcher without an explicit location
+            watcher = ConfigWatcher()
+
+            # THEN it loads the file the environment points to
+            assert watcher.location == f"{self.test_dir_data}/config_with_sig.yaml"
+            assert len(watcher.get().signatures) == 6
+
+        with patch.dict("os.environ", {"CONFIG_LOCATION": f"{self.test_dir_data}/wrong_config.yaml"}):
+            # AND WHEN the file does not exist
+            # THEN an error is raised
+            with pytest.raises(FileNotFoundError):
+                watcher.get()
+
+    def test_cache_shares_sessions_by_config_content(self):
+        # GIVEN a session cache and two configs
+        cache = SessionCache(max_size=2)
+        with open(f"{self.test_dir_data}/config_with_sig.yaml", mode="r") as file:
+            config = file.read()
+        other_config = "test: 'Field'"
+
+        # WHEN the same config content is requested twice
+        session = cache.get(config)
+
+        # THEN it is compiled once and shared, and the lookups are counted
+        assert cache.get(config) is session
+        assert session.fingerprint == Session(config).fingerprint
+        assert cache.stats() == {"size": 1, "max_size": 2, "hits": 1, "misses": 1}
+
+        # AND WHEN more configs than the cache holds are requested
+        cache.get(other_config)
+        cache.get(config)
+        cache.get("signatures: []")
+
+        # THEN the least recently used one is evicted
+        assert len(cache) == 2
+        assert cache.get(config) is session
+        assert cache.stats()["misses"] == 3
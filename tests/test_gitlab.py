@@ -1,10 +1,20 @@
 import os
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import MagicMock, Mock, patch
 
 import pytest
-
-from shhbt.gitclient.gitlab import handle_gitlab_event, _GitLab, CommitStatus
+import requests
+
+from shhbt.gitclient.gitlab import (
+    FILE_RESULTS,
+    RAW_FETCH_ABORTED,
+    VERDICTS,
+    handle_gitlab_event,
+    _ByteBudget,
+    _GitLab,
+    CommitStatus,
+)
+from shhbt.scanner import thread_executor
 from shhbt.session import Session
 from tests.data import api_json_res
 
@@ -28,6 +38,8 @@ class TestGitLabIntegration(TestCase):
     }
 
     def setUp(self) -> None:
+        VERDICTS.clear()
+
         self.gitlab_config_mock = self.gitlab_config_patch.start()
         self.gitlab_config_mock.return_value = False, None
 
@@ -160,3 +172,244 @@ class TestGitLabIntegration(TestCase):
         # THEN the cli's session has empty signatures and blacklists
         assert cli.session.signatures == []
         assert cli.session.blacklists == []
+
+    @patch("shhbt.scanner.SIGNATURE_BUDGET", 1e-9)
+    @patch.dict("os.environ", test_env)
+    def test_signatures_out_of_budget_fail_the_commit(self):
+        FILE_RESULTS.clear()
+        # GIVEN content signatures with almost no time to run
+        self.diff_mock.return_value = api_json_res.DIFF_UNSAFE_FILE_CONTENT
+
+        # WHEN a diff is scanned
+        handle_gitlab_event(event_body=api_json_res.EVENT_FOR_UNSAFE)
+
+        # THEN the commit fails, naming the signatures that were aborted
+        project = api_json_res.EVENT_FOR_UNSAFE.get("project").get("id")
+        (proj, commit, status, findings), _ = self.gitlab_change_status_mock.call_args
+        assert (proj, commit, status) == (project, "test_sha", CommitStatus.FAILED)
+        assert [(issue.signature_name, issue.aborted) for issue in findings] == [("Contains a private key", True)]
+
+        # AND the results of the scan are not kept
+        assert len(FILE_RESULTS._results) == 0
+
+        # AND WHEN another event for the same commit and config is received
+        handle_gitlab_event(event_body=api_json_res.EVENT_FOR_UNSAFE)
+
+        # THEN the commit is scanned again
+        assert self.diff_mock.call_count == 2
+
+    @patch.dict("os.environ", test_env)
+    def test_repeated_events_reuse_the_verdict(self):
+        # Mock prep
+        self.diff_mock.return_value = api_json_res.DIFF_UNSAFE_FILE_CONTENT
+
+        # GIVEN an event that was already scanned
+        handle_gitlab_event(event_body=api_json_res.EVENT_FOR_UNSAFE)
+
+        # WHEN another event for the same commit and config is received
+        handle_gitlab_event(event_body=api_json_res.EVENT_FOR_UNSAFE)
+
+        # THEN the diff was only fetched and scanned once
+        assert self.diff_mock.call_count == 1
+
+        # AND THEN the second event only posted the final status
+        assert self.gitlab_change_status_mock.call_args_list == [
+            ((api_json_res.EVENT_FOR_UNSAFE.get("project").get("id"), "test_sha", CommitStatus.PENDING),),
+            ((api_json_res.EVENT_FOR_UNSAFE.get("project").get("id"), "test_sha", CommitStatus.FAILED),),
+            ((api_json_res.EVENT_FOR_UNSAFE.get("project").get("id"), "test_sha", CommitStatus.FAILED),),
+        ]
+
+    def test_identical_changes_are_scanned_once(self):
+        FILE_RESULTS.clear()
+
+        # GIVEN a client with a session
+        cli = _GitLab(hostname="test", token="test")
+        with open(f"{self.test_dir_data}/config_with_sig.yaml", mode="r") as f:
+            cli.session = Session(f)
+        change = api_json_res.DIFF_UNSAFE_FILE_CONTENT[0]
+
+        # WHEN the same change is processed twice
+        with patch("shhbt.gitclient.gitlab._GitLab._scan_file_change", wraps=cli._scan_file_change) as scan_mock:
+            first = cli._process_file_change(change.get("new_path"), change.get("diff"))
+            second = cli._process_file_change(change.get("new_path"), change.get("diff"))
+
+        # THEN it is only scanned once and both calls return the same findings
+        assert scan_mock.call_count == 1
+        assert first == second
+        assert [issue.signature_name for issue in first] == ["Contains a private key"]
+
+    def test_process_backend_finds_the_same_issues(self):
+        FILE_RESULTS.clear()
+
+        # GIVEN a client scanning in worker processes
+        cli = _GitLab(hostname="test", token="test", backend="processes", processes=2, inline_files=0)
+        with open(f"{self.test_dir_data}/config_with_sig.yaml", mode="r") as f:
+            cli.session = Session(f)
+
+        # WHEN changes are processed
+        error, findings = cli._process_changes("namespace", api_json_res.DIFF_UNSAFE_FILE_CONTENT)
+
+        # THEN they report the findings the threads would
+        assert not error
+        assert [issue.signature_name for issue in findings] == ["Contains a private key"]
+
+    def test_small_diffs_are_scanned_inline(self):
+        FILE_RESULTS.clear()
+
+        # GIVEN a client that scans diffs of less than two files inline
+        cli = _GitLab(hostname="test", token="test", inline_files=2)
+        with open(f"{self.test_dir_data}/config_with_sig.yaml", mode="r") as f:
+            cli.session = Session(f)
+
+        # WHEN a diff of a single file is processed
+        with patch("shhbt.gitclient.gitlab.thread_executor") as executor_mock:
+            error, findings = cli._process_changes("namespace", api_json_res.DIFF_UNSAFE_FILE_CONTENT)
+
+        # THEN no pool is used
+        executor_mock.assert_not_called()
+        assert not error
+        assert [issue.signature_name for issue in findings] == ["Contains a private key"]
+
+        # AND WHEN a larger diff is processed
+        executor_mock = MagicMock(wraps=thread_executor)
+        with patch("shhbt.gitclient.gitlab.thread_executor", executor_mock):
+            error, findings = cli._process_changes(
+                "namespace", api_json_res.DIFF_UNSAFE_FILE_CONTENT + api_json_res.DIFF_UNSAFE_FILENAME
+            )
+
+        # THEN it is scanned on the shared pool
+        executor_mock.assert_called_once_with(cli.options.threads)
+        assert not error
+        assert len(findings) == 2
+
+    def test_clients_share_http_sessions(self):
+        # GIVEN two clients of the same instance and token
+        first = _GitLab(hostname="shared", token="test")
+        second = _GitLab(hostname="shared", token="test")
+
+        # THEN they share their connections, but not with other tokens
+        assert first.http_session is second.http_session
+        assert _GitLab(hostname="shared", token="other").http_session is not first.http_session
+
+    @patch("time.sleep")
+    @patch("requests.Session.request")
+    def test_idempotent_requests_are_retried(self, req_mock, sleep_mock):
+        cli = _GitLab(hostname="test", token="test", retries=2, backoff=1)
+
+        # GIVEN an instance that fails transiently before answering
+        req_mock.side_effect = [Mock(status_code=503), requests.ConnectionError(), Mock(status_code=200)]
+
+        # WHEN a GET is sent
+        # THEN it is retried until it succeeds, backing off a bit longer each time
+        assert cli._request("GET", "url").status_code == 200
+        assert req_mock.call_count == 3
+        assert [0 <= c.args[0] <= 2**i for i, c in enumerate(sleep_mock.call_args_list)] == [True, True]
+
+        # AND WHEN a POST fails
+        req_mock.reset_mock()
+        req_mock.side_effect = [Mock(status_code=503), Mock(status_code=200)]
+
+        # THEN it is not retried unless it's said to be safe
+        assert cli._request("POST", "url").status_code == 503
+        assert cli._request("POST", "url", retry=True).status_code == 200
+
+        # AND WHEN the instance keeps failing
+        req_mock.side_effect = requests.ConnectionError()
+
+        # THEN the last error is raised
+        with pytest.raises(requests.ConnectionError):
+            cli._request("GET", "url")
+
+
+class TestGitLabDiffPages(TestCase):
+    test_dir_data = f"{os.path.dirname(__file__)}/data"
+
+    @patch("requests.Session.request")
+    def test_fetches_every_page_as_it_is_consumed(self, req_mock):
+        cli = _GitLab(hostname="test", token="test", diff_page_size=2)
+        pages = [[{"new_path": "a"}, {"new_path": "b"}], [{"new_path": "c"}, {"new_path": "d"}], [{"new_path": "e"}]]
+        req_mock.side_effect = [Mock(**{"json.return_value": page}) for page in pages]
+
+        # GIVEN a diff spread over three pages
+        # WHEN its first change is read
+        changes = cli._fetch_diff(proj_id="1", commit="test_sha")
+        assert next(changes) == {"new_path": "a"}
+
+        # THEN only the first page was fetched
+        assert req_mock.call_count == 1
+
+        # AND WHEN every change is read
+        # THEN the following pages are fetched, stopping at the first short page
+        assert [change["new_path"] for change in changes] == ["b", "c", "d", "e"]
+        assert [c.kwargs["params"] for c in req_mock.call_args_list] == [
+            {"page": 1, "per_page": 2},
+            {"page": 2, "per_page": 2},
+            {"page": 3, "per_page": 2},
+        ]
+
+    @patch("requests.Session.request")
+    def test_scans_files_left_out_of_the_diff(self, req_mock):
+        FILE_RESULTS.clear()
+        cli = _GitLab(hostname="test", token="test")
+        with open(f"{self.test_dir_data}/config_with_sig.yaml", mode="r") as f:
+            cli.session = Session(f)
+
+        # GIVEN a diff where GitLab left out files for being too large
+        diffs = [
+            {"new_path": "big/keys.txt", "diff": "", "too_large": True},
+            {"new_path": "big/other.txt", "diff": "", "collapsed": True},
+        ]
+        contents = {
+            "keys": [b"line one\n-----BEGIN RSA PRI", b"VATE KEY-----\nthird line"],
+            "other": [b"line one\n", b"line two"],
+        }
+        req_mock.side_effect = lambda **kwargs: Mock(
+            **{"iter_content.return_value": iter(contents["keys" if "keys" in kwargs["url"] else "other"])}
+        )
+
+        # WHEN the diff is processed
+        error, findings = cli._process_changes("namespace", diffs, proj_id="1", commit="test_sha")
+
+        # THEN the files are fetched from the commit and scanned as a whole
+        assert not error
+        assert [(issue.file_rel_path, issue.line_number) for issue in findings] == [("big/keys.txt", 2)]
+        assert sorted(c.kwargs["url"] for c in req_mock.call_args_list) == [
+            "test/api/v4/projects/1/repository/files/big%2Fkeys.txt/raw",
+            "test/api/v4/projects/1/repository/files/big%2Fother.txt/raw",
+        ]
+        assert req_mock.call_args_list[0].kwargs["params"] == {"ref": "test_sha"}
+
+    @patch("requests.Session.request")
+    def test_stops_fetching_files_out_of_budget(self, req_mock):
+        cli = _GitLab(hostname="test", token="test", raw_fetch_budget=20)
+
+        # GIVEN a file larger than the budget of the event
+        req_mock.return_value = Mock(**{"iter_content.return_value": iter([b"first line\n", b"second line\n"])})
+
+        # WHEN it is fetched
+        budget = _ByteBudget(20)
+        lines = list(cli._fetch_raw_lines("1", "test_sha", "big/keys.txt", budget))
+
+        # THEN it is read up to the budget, and left in the aborted set of the budget
+        assert lines == [(1, "first line")]
+        assert budget.aborted == {"big/keys.txt"}
+        req_mock.return_value.close.assert_called_once()
+
+    @patch("requests.Session.request")
+    def test_files_out_of_budget_are_aborted(self, req_mock):
+        cli = _GitLab(hostname="test", token="test", raw_fetch_budget=20)
+        with open(f"{self.test_dir_data}/config_with_sig.yaml", mode="r") as f:
+            cli.session = Session(f)
+
+        # GIVEN a diff leaving out a file larger than the budget of the event
+        diffs = [{"new_path": "big/keys.txt", "diff": "", "too_large": True}]
+        req_mock.return_value = Mock(**{"iter_content.return_value": iter([b"first line\n", b"second line\n"])})
+
+        # WHEN the diff is processed
+        error, findings = cli._process_changes("namespace", diffs, proj_id="1", commit="test_sha")
+
+        # THEN the file is reported as aborted, so the commit can't pass
+        assert not error
+        assert [(issue.signature_name, issue.file_rel_path, issue.aborted) for issue in findings] == [
+            (RAW_FETCH_ABORTED, "big/keys.txt", True)
+        ]
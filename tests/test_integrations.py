@@ -4,7 +4,10 @@ from unittest import TestCase
 from unittest.mock import Mock, patch
 
 from shhbt.gitclient import CommitStatus
-from shhbt.server import create_flask_app
+from shhbt.gitclient.gitlab import FILE_RESULTS, VERDICTS
+from shhbt.metrics import METRICS
+from shhbt.scanner import thread_executor
+from shhbt.server import create_flask_app, shutdown_app
 from tests.data import api_json_res
 
 
@@ -20,6 +23,8 @@ class TestIntegrations(TestCase):
     test_client = None
 
     def setUp(self) -> None:
+        VERDICTS.clear()
+
         _app = create_flask_app()
         self.test_client = _app.test_client()
 
@@ -83,3 +88,128 @@ class TestIntegrations(TestCase):
         assert self.test_client.get("/test-endpoint").status_code == 404
         assert self.test_client.put("/test-endpoint").status_code == 404
         assert self.test_client.delete("/test-endpoint").status_code == 404
+
+    @patch("shhbt.gitclient.gitlab._GitLab._update_commit_status")
+    @patch("requests.Session.request")
+    def test_default_config_is_compiled_once_at_startup(self, req_mock, status_mock):
+        # GIVEN an app created with a default config
+        _app = create_flask_app({"CONFIG_LOCATION": f"{self.test_dir_data}/config_with_sig.yaml"})
+        client = _app.test_client()
+
+        diff_mock = Mock()
+        diff_mock.json.return_value = api_json_res.DIFF_UNSAFE_FILE_CONTENT
+        req_mock.side_effect = [Mock(), diff_mock, Mock()]  # No config repo, specific diff, no config repo again
+
+        # WHEN two events without a repo config are received
+        with patch("shhbt.session.Session", side_effect=AssertionError("config compiled again")), patch.dict(
+            "os.environ", self.test_env
+        ):
+            for _ in range(2):
+                assert (
+                    client.post(
+                        "/", headers={"X-Gitlab-Event": "test-event"}, json=api_json_res.EVENT_FOR_UNSAFE
+                    ).status_code
+                    == 200
+                )
+
+        # THEN both were handled with the session compiled at startup
+        assert status_mock.call_count == 3
+        assert status_mock.call_args_list[-1] == (
+            (api_json_res.EVENT_FOR_UNSAFE.get("project").get("id"), "test_sha", CommitStatus.FAILED),
+        )
+
+    @patch("shhbt.gitclient.gitlab._GitLab._update_commit_status")
+    @patch("requests.Session.request")
+    @patch.dict("os.environ", test_env)
+    def test_async_mode_accepts_events_and_scans_in_background(self, req_mock, status_mock):
+        # GIVEN an app that handles events in the background
+        _app = create_flask_app({"ASYNC_EVENTS": True, "EVENT_WORKERS": 1})
+        client = _app.test_client()
+        events = _app.extensions["shhbt_events"]
+
+        diff_mock = Mock()
+        diff_mock.json.return_value = api_json_res.DIFF_UNSAFE_FILE_CONTENT
+        req_mock.side_effect = [Mock(), diff_mock]  # No config repo, specific diff
+
+        # WHEN an event is received
+        # THEN it is accepted straight away
+        assert (
+            client.post("/", headers={"X-Gitlab-Event": "test-event"}, json=api_json_res.EVENT_FOR_UNSAFE).status_code
+            == 202
+        )
+        assert client.get("/queue").get_json()["max_size"] == 100
+
+        # AND WHEN the queue is drained
+        events.shutdown(timeout=5)
+
+        # THEN the event was scanned and the statuses updated
+        assert status_mock.call_args_list == [
+            ((api_json_res.EVENT_FOR_UNSAFE.get("project").get("id"), "test_sha", CommitStatus.PENDING),),
+            ((api_json_res.EVENT_FOR_UNSAFE.get("project").get("id"), "test_sha", CommitStatus.FAILED),),
+        ]
+
+        # AND new events are turned away while shutting down
+        assert (
+            client.post("/", headers={"X-Gitlab-Event": "test-event"}, json=api_json_res.EVENT_FOR_UNSAFE).status_code
+            == 503
+        )
+
+    @patch.dict("os.environ", test_env)
+    def test_shutting_down_drains_events_before_the_executors(self):
+        # GIVEN an app whose queued events run work on a shared executor
+        handled = []
+
+        def handler(event, default_config=None):
+            handled.append(thread_executor(2).submit(lambda: event["id"]).result())
+
+        with patch("shhbt.server.handle_gitlab_event", side_effect=handler):
+            _app = create_flask_app({"ASYNC_EVENTS": True, "EVENT_WORKERS": 1})
+            client = _app.test_client()
+            for nr in range(3):
+                event = dict(api_json_res.EVENT_FOR_UNSAFE, id=nr)
+                assert client.post("/", headers={"X-Gitlab-Event": "test-event"}, json=event).status_code == 202
+
+            # WHEN the app is shut down
+            executor = thread_executor(2)
+            shutdown_app(_app, timeout=5)
+
+        # THEN every event was handled, with the executor still taking work, which was shut down after
+        assert handled == [0, 1, 2]
+        with self.assertRaises(RuntimeError):
+            executor.submit(lambda: None)
+
+    def test_queue_status_needs_async_mode(self):
+        assert self.test_client.get("/queue").status_code == 404
+
+    def test_metrics_need_to_be_enabled(self):
+        assert self.test_client.get("/metrics").status_code == 404
+
+    @patch("shhbt.gitclient.gitlab._GitLab._update_commit_status")
+    @patch("requests.Session.request")
+    @patch.dict("os.environ", test_env)
+    def test_metrics_report_signature_cost_and_hits(self, req_mock, status_mock):
+        # GIVEN an app measuring its signatures
+        FILE_RESULTS.clear()
+        METRICS.clear()
+        client = create_flask_app({"SIGNATURE_METRICS": True}).test_client()
+
+        diff_mock = Mock()
+        diff_mock.json.return_value = api_json_res.DIFF_UNSAFE_FILE_CONTENT
+        req_mock.side_effect = [Mock(), diff_mock]  # No config repo, specific diff
+
+        try:
+            # WHEN a diff holding a private key is scanned
+            client.post("/", headers={"X-Gitlab-Event": "test-event"}, json=api_json_res.EVENT_FOR_UNSAFE)
+            response = client.get("/metrics")
+        finally:
+            METRICS.enabled = False
+            METRICS.clear()
+
+        # THEN the metrics of the content signature are exposed for Prometheus
+        assert response.status_code == 200
+        assert response.mimetype == "text/plain"
+        body = response.get_data(as_text=True)
+        assert "# TYPE shhbt_signature_seconds_total counter" in body
+        hits = [line for line in body.splitlines() if line.startswith("shhbt_signature_hits_total{")]
+        assert len(hits) == 1
+        assert hits[0].endswith('index="5",signature="Contains a private key",part="contents"} 1')
@@ -0,0 +1,114 @@
+import os
+from unittest import TestCase
+
+from shhbt.metrics import BYTES, CALLS, HITS, METRICS, SECONDS, SignatureMetrics
+from shhbt.scanner import ProcessScanner, scan_file_change
+from shhbt.session import Session, SessionCache
+from shhbt.signatures import ContentMatcher, PatternSignature
+from tests.data import api_json_res
+
+
+class TestSignatureMetrics(TestCase):
+    test_dir_data = f"{os.path.dirname(__file__)}/data"
+
+    def setUp(self) -> None:
+        METRICS.clear()
+        with open(f"{self.test_dir_data}/config_with_sig.yaml", mode="r") as f:
+            self.session = Session(f)
+        self.changes = [
+            (d.get("new_path"), d.get("diff"))
+            for d in api_json_res.DIFF_UNSAFE_FILE_CONTENT + api_json_res.DIFF_UNSAFE_FILENAME
+        ]
+
+    def tearDown(self) -> None:
+        METRICS.enabled = False
+        METRICS.clear()
+
+    def test_content_matcher_counts_each_signature(self):
+        # GIVEN a gated, a buffered and a line by line content signature
+        signatures = [
+            PatternSignature(regex=r"(?i)sonar.{0,5}[0-9a-f]{4}", part="contents", name="sonar"),
+            PatternSignature(regex="[0-9]{3}-[0-9]{3}", part="contents", name="ids"),
+            PatternSignature(regex=r"^\+p", part="contents", name="password"),
+        ]
+        matcher = ContentMatcher(list(enumerate(signatures)))
+        lines = ["+sonar beef", "+ids 123-456 789-012", "+pw"]
+
+        # WHEN lines are scanned with counters
+        counters = {}
+        hits = matcher.scan(enumerate(lines), counters)
+
+        # THEN every signature counts the calls, characters and matches of its own evaluations
+        assert hits == {0: [(0, 1)], 1: [(1, 2)], 2: [(2, 1)]}
+        assert [counters[0][CALLS], counters[0][BYTES], counters[0][HITS]] == [1, len(lines[0]), 1]
+        assert [counters[1][CALLS], counters[1][BYTES], counters[1][HITS]] == [1, len("\n".join(lines)), 2]
+        assert [counters[2][CALLS], counters[2][BYTES], counters[2][HITS]] == [3, sum(map(len, lines)), 1]
+        assert all(values[SECONDS] > 0 for values in counters.values())
+
+    def test_scans_are_only_measured_when_enabled(self):
+        # GIVEN metrics that are disabled
+        # WHEN a file is scanned
+        scan_file_change(self.session, *self.changes[0])
+
+        # THEN nothing is measured
+        assert METRICS.snapshot() == {}
+
+        # AND WHEN they are enabled
+        METRICS.enabled = True
+        for change in self.changes:
+            scan_file_change(self.session, *change)
+
+        # THEN content and file signatures are measured, by session and signature
+        snapshot = METRICS.snapshot()
+        assert snapshot[(self.session.fingerprint, 5)][HITS] == 1
+        assert snapshot[(self.session.fingerprint, 1)][HITS] == 1
+
+    def test_renders_prometheus_text(self):
+        # GIVEN the counters of a signature whose name needs escaping
+        self.session.signatures[5].name = 'private "key"'
+        METRICS.add(self.session, {5: [2, 0.5, 100, 1]})
+
+        # WHEN they are rendered
+        body = METRICS.render()
+
+        # THEN every counter is there, with escaped labels
+        labels = f'config="{self.session.fingerprint[:12]}",index="5",signature="private \\"key\\"",part="contents"'
+        assert f"shhbt_signature_calls_total{{{labels}}} 2" in body
+        assert f"shhbt_signature_seconds_total{{{labels}}} 0.5" in body
+        assert f"shhbt_signature_bytes_total{{{labels}}} 100" in body
+        assert f"shhbt_signature_hits_total{{{labels}}} 1" in body
+
+    def test_worker_processes_hand_back_their_metrics(self):
+        # GIVEN metrics that are enabled, and a pool of worker processes
+        METRICS.enabled = True
+        scanner = ProcessScanner(workers=1)
+
+        # WHEN changes are scanned in the workers
+        try:
+            scanner.scan(self.session, self.changes)
+        finally:
+            scanner.shutdown()
+
+        # THEN their metrics are added up in this process
+        assert METRICS.snapshot()[(self.session.fingerprint, 5)][HITS] == 1
+
+    def test_keeps_the_metrics_of_recently_measured_sessions_only(self):
+        # GIVEN metrics for up to two sessions, and three sessions measured one after the other
+        metrics = SignatureMetrics(max_configs=2)
+        sessions = [Session(f"signatures: []\n# {nr}") for nr in range(3)]
+        for session in sessions:
+            metrics.add(session, {0: [1, 0.1, 10, 0]})
+
+        # THEN only the counters of the last two are kept
+        assert sorted(metrics.snapshot()) == sorted((session.fingerprint, 0) for session in sessions[1:])
+
+    def test_metrics_are_evicted_with_their_session(self):
+        # GIVEN a session cache holding one session, whose scans were measured
+        cache = SessionCache(max_size=1)
+        METRICS.add(cache.get(self.session.config_content), {5: [1, 0.1, 10, 1]})
+
+        # WHEN another session takes its place
+        cache.get("signatures: []")
+
+        # THEN its metrics are dropped as well
+        assert METRICS.snapshot() == {}
@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from shhbt.utils import extract_additions
+from shhbt.utils import extract_additions, iter_additions, iter_file_diffs
 
 
 class TestUtilsSignatures(TestCase):
@@ -44,3 +44,59 @@ class TestUtilsSignatures(TestCase):
         # THEN dditions is not None but is an empty list
         assert additions is not None
         assert len(additions) == 0
+
+    def test_iter_additions_yields_new_line_numbers(self):
+        # GIVEN a diff with file headers, two hunks, removals and context
+        diff_input = (
+            "--- a/config.py\n"
+            "+++ b/config.py\n"
+            "@@ -1,4 +1,5 @@\n"
+            " import os\n"
+            "-TOKEN = None\n"
+            "+TOKEN = os.getenv('TOKEN')\n"
+            "+++counter\n"
+            " \n"
+            " DEBUG = False\n"
+            "@@ -20,2 +21,3 @@ def main():\n"
+            "     run()\n"
+            "+    print('done')\n"
+            "\\ No newline at end of file\n"
+            "+\n"
+            "+    exit()"
+        )
+
+        # WHEN the additions are iterated
+        additions = list(iter_additions(text=diff_input))
+
+        # THEN only added lines are yielded, with their number in the new file, and file headers are skipped
+        assert additions == [
+            (2, "+TOKEN = os.getenv('TOKEN')"),
+            (3, "+++counter"),
+            (22, "+    print('done')"),
+            (24, "+    exit()"),
+        ]
+
+    def test_iter_additions_handles_empty_diffs(self):
+        assert list(iter_additions(text="")) == []
+        assert list(iter_additions(text=None)) == []
+
+    def test_splits_diffs_by_file(self):
+        # GIVEN the diff of a rename, a binary file, a deletion and a file with spaces in its name
+        diff_input = (
+            "diff --git a/d/k.txt b/moved.txt\nsimilarity index 100%\nrename from d/k.txt\nrename to moved.txt\n"
+            "diff --git a/bin.dat b/bin.dat\nnew file mode 100644\nBinary files /dev/null and b/bin.dat differ\n"
+            "diff --git a/x.txt b/x.txt\ndeleted file mode 100644\n--- a/x.txt\n+++ /dev/null\n@@ -1 +0,0 @@\n-a\n"
+            "diff --git a/z w.txt b/z w.txt\n--- /dev/null\n+++ b/z w.txt\t\n@@ -0,0 +1,2 @@\n+a\n+new\n"
+        )
+
+        # WHEN it is split by file
+        files = list(iter_file_diffs(diff_input))
+
+        # THEN every file that was not deleted is there, with its hunks
+        assert files == [("moved.txt", ""), ("bin.dat", ""), ("z w.txt", "@@ -0,0 +1,2 @@\n+a\n+new\n")]
+
+    def test_splits_plain_unified_diffs(self):
+        diff_input = "--- old/a.py\t2020-01-01\n+++ new/a.py\t2020-01-02\n@@ -1 +1 @@\n-a\n+b\n"
+
+        assert list(iter_file_diffs(diff_input)) == [("new/a.py", "@@ -1 +1 @@\n-a\n+b\n")]
+        assert list(iter_file_diffs("")) == []
@@ -0,0 +1,74 @@
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import Mock
+
+from shhbt.ratelimit import RateLimiter, rate_limiter
+
+
+def _timed(call) -> float:
+    start = time.monotonic()
+    call()
+    return time.monotonic() - start
+
+
+class TestRateLimiter(TestCase):
+    def test_allows_bursts_then_the_rate(self):
+        # GIVEN a limiter of 20 requests per second, in bursts of 2
+        limiter = RateLimiter(rate=20, burst=2)
+
+        # WHEN requests are sent
+        # THEN the burst goes right away and the next one waits for the bucket to refill
+        assert _timed(limiter.acquire) < 0.02
+        assert _timed(limiter.acquire) < 0.02
+        assert 0.03 < _timed(limiter.acquire) < 0.2
+
+    def test_follows_the_rate_limit_headers(self):
+        limiter = RateLimiter(rate=20, burst=10)
+
+        # GIVEN an instance asking to retry later
+        limiter.update({"Retry-After": "0.1"})
+
+        # WHEN a request is sent THEN it waits until then
+        assert 0.08 < _timed(limiter.acquire) < 0.3
+
+        # AND GIVEN an instance with a single request left
+        limiter.update({"RateLimit-Remaining": "1"})
+
+        # THEN only that one goes right away
+        assert _timed(limiter.acquire) < 0.02
+        assert 0.03 < _timed(limiter.acquire) < 0.2
+
+    def test_ignores_missing_or_bogus_headers(self):
+        limiter = RateLimiter(rate=20, burst=1)
+
+        limiter.update(Mock())
+        limiter.update({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT", "RateLimit-Remaining": None})
+
+        assert _timed(limiter.acquire) < 0.02
+
+    def test_priority_requests_go_first(self):
+        # GIVEN a limiter with no tokens left
+        limiter = RateLimiter(rate=5, burst=1)
+        limiter.acquire()
+        order = []
+
+        def send(name, priority):
+            limiter.acquire(priority=priority)
+            order.append(name)
+
+        # WHEN a request waits for a token and a priority request comes in after it
+        normal = threading.Thread(target=send, args=("fetch", False))
+        normal.start()
+        time.sleep(0.05)
+        urgent = threading.Thread(target=send, args=("status", True))
+        urgent.start()
+        normal.join(timeout=2)
+        urgent.join(timeout=2)
+
+        # THEN the priority request is sent first
+        assert order == ["status", "fetch"]
+
+    def test_limiters_are_shared_per_instance(self):
+        assert rate_limiter("instance", rate=1, burst=1) is rate_limiter("instance", rate=2, burst=2)
+        assert rate_limiter("instance", rate=1, burst=1) is not rate_limiter("other", rate=1, burst=1)
@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from shhbt.__main__ import main
+from shhbt.ruleset import RulesetCache
+from shhbt.scanner import scan_file_change
+from shhbt.session import Session
+from tests.data import api_json_res
+
+
+class TestRuleset(TestCase):
+    test_dir_data = f"{os.path.dirname(__file__)}/data"
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.rulesets = RulesetCache(directory=self.directory.name)
+        with open(f"{self.test_dir_data}/config_with_blacklists.yaml", mode="r") as f:
+            self.config = f.read()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def _scan(self, session):
+        return [
+            scan_file_change(session, d.get("new_path"), d.get("diff"))
+            for d in api_json_res.DIFF_UNSAFE_FILE_CONTENT + api_json_res.DIFF_UNSAFE_FILENAME
+        ]
+
+    def test_sessions_load_the_compiled_ruleset(self):
+        # GIVEN a session compiled from a config
+        compiled = Session(self.config, rulesets=self.rulesets)
+        assert os.path.exists(self.rulesets.path(compiled.fingerprint))
+
+        # WHEN the same config is loaded again
+        with patch("shhbt.session.Session._load_config", side_effect=AssertionError("config parsed again")), patch(
+            "shhbt.signatures.required_literals", side_effect=AssertionError("regex analysed again")
+        ):
+            loaded = Session(self.config, rulesets=self.rulesets)
+
+        # THEN it's built from the ruleset and scans the same
+        assert loaded.ruleset() == compiled.ruleset()
+        assert [sig.name for sig in loaded.signatures] == [sig.name for sig in compiled.signatures]
+        assert self._scan(loaded) == self._scan(compiled)
+        assert loaded.blacklist_matcher.match("tests/a.py", "py") and loaded.blacklist_matcher.match("a/b.jpg", "jpg")
+
+    def test_rulesets_keep_entropy_signatures(self):
+        # GIVEN a config with an entropy signature, compiled to a ruleset
+        config = self.config + "  - {part: contents, entropy: 3.5, charset: hex, min_length: 32, name: hex}\n"
+        compiled = Session(config, rulesets=self.rulesets)
+
+        # WHEN it is loaded again
+        loaded = Session(config, rulesets=self.rulesets)
+
+        # THEN the signature is built back as it was
+        assert loaded.ruleset() == compiled.ruleset()
+        assert loaded.content_matcher.scan([(0, "+" + "0123456789abcdef" * 2)]) == {
+            len(loaded.signatures) - 1: [(0, 1)]
+        }
+
+    def test_ignores_rulesets_it_cannot_trust(self):
+        session = Session(self.config, rulesets=self.rulesets)
+        path = self.rulesets.path(session.fingerprint)
+
+        for change in ({"version": 0}, {"python": [2, 7]}, {"fingerprint": "other"}, {"reject_unsafe": False}):
+            # GIVEN a ruleset of another version, Python, config or policy on unsafe signatures
+            with open(path, mode="w") as f:
+                json.dump({**session.ruleset(), **change}, f)
+
+            # THEN it is not loaded
+            assert self.rulesets.load(session.fingerprint) is None
+
+        # AND GIVEN a broken ruleset THEN the config is parsed again
+        with open(path, mode="w") as f:
+            f.write("{")
+        assert self.rulesets.load(session.fingerprint) is None
+        assert Session(self.config, rulesets=self.rulesets).ruleset() == session.ruleset()
+
+    def test_nothing_is_cached_without_a_directory(self):
+        assert RulesetCache().load(Session(self.config).fingerprint) is None
+
+    def test_cli_compiles_a_config(self):
+        code = main(["compile", f"{self.test_dir_data}/config_with_blacklists.yaml", "--cache", self.directory.name])
+
+        assert code == 0
+        assert self.rulesets.load(Session(self.config).fingerprint) is not None
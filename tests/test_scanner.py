@@ -0,0 +1,99 @@
+import os
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from shhbt.scanner import (
+    ProcessScanner,
+    _WORKER_SESSIONS,
+    iter_batches,
+    _scan_batch,
+    scan_file_change,
+    shutdown_scanners,
+    thread_executor,
+)
+from shhbt.session import Session
+from tests.data import api_json_res
+
+
+class TestScanner(TestCase):
+    test_dir_data = f"{os.path.dirname(__file__)}/data"
+
+    def setUp(self) -> None:
+        with open(f"{self.test_dir_data}/config_with_sig.yaml", mode="r") as f:
+            self.session = Session(f)
+        self.changes = [
+            (d.get("new_path"), d.get("diff"))
+            for d in api_json_res.DIFF_UNSAFE_FILE_CONTENT + api_json_res.DIFF_UNSAFE_FILENAME
+        ]
+
+    def test_batches_split_changes_by_size(self):
+        changes = [("a", "x" * 10), ("b", "x" * 10), ("c", None), ("d", "x" * 30)]
+
+        assert list(iter_batches(iter(changes), batch_bytes=20)) == [changes[:2], changes[2:]]
+        assert list(iter_batches(iter(changes), batch_bytes=1)) == [[changes[0]], [changes[1]], changes[2:]]
+        assert list(iter_batches(iter([]), batch_bytes=20)) == []
+
+    def test_thread_executors_are_shared(self):
+        # GIVEN the executor of a given size
+        executor = thread_executor(3)
+
+        # WHEN it is asked for again THEN the same executor is returned
+        assert thread_executor(3) is executor
+        assert thread_executor(2) is not executor
+        assert executor._max_workers == 3
+
+    def test_shutdown_scanners_stops_the_shared_executors(self):
+        # GIVEN a shared executor with some work done
+        executor = thread_executor(3)
+        done = executor.submit(lambda: 1)
+
+        # WHEN the scanners are shut down
+        shutdown_scanners()
+
+        # THEN the work was finished, the executor takes no more, and a new one is created when asked for
+        assert done.result(timeout=0) == 1
+        with self.assertRaises(RuntimeError):
+            executor.submit(lambda: 2)
+        assert thread_executor(3) is not executor
+
+    def test_workers_ask_for_unknown_sessions(self):
+        _WORKER_SESSIONS.clear()
+
+        # GIVEN a worker that has not compiled the session yet
+        # WHEN it is only given the fingerprint
+        # THEN it asks for the config
+        assert _scan_batch(self.session.fingerprint, None, self.changes) is None
+
+        # AND WHEN it is given the config once
+        first = _scan_batch(self.session.fingerprint, self.session.config_content, self.changes)
+
+        # THEN it keeps the compiled session for the next batches
+        assert _scan_batch(self.session.fingerprint, None, self.changes) == first
+        assert first == ([scan_file_change(self.session, new_path, diff) for new_path, diff in self.changes], None)
+
+    def test_processes_find_the_same_issues_as_threads(self):
+        # GIVEN a pool of worker processes
+        scanner = ProcessScanner(workers=2)
+
+        try:
+            # WHEN changes are scanned in batches of a single change
+            findings = scanner.scan(self.session, self.changes, batch_bytes=1)
+
+            # THEN findings are those of a scan in this process, in the same order
+            assert findings == [scan_file_change(self.session, new_path, diff) for new_path, diff in self.changes]
+            assert any(findings)
+        finally:
+            scanner.shutdown()
+
+    def test_shutdown_drops_the_pool_on_python_3_8(self):
+        # GIVEN a scanner with a pool, on a Python without cancel_futures
+        scanner = ProcessScanner(workers=1)
+        pool = scanner._pool = Mock()
+
+        # WHEN it's shut down
+        with patch("shhbt.scanner.sys.version_info", (3, 8, 18)):
+            scanner.shutdown()
+
+        # THEN the pool is shut down without it, and a new one is started on the next scan
+        pool.shutdown.assert_called_once_with(wait=False)
+        assert scanner._pool is None
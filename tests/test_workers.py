@@ -0,0 +1,88 @@
+import threading
+from unittest import TestCase
+
+import pytest
+
+from shhbt.workers import EventQueue
+
+
+class TestEventQueue(TestCase):
+    def test_raises_if_no_workers_or_slots(self):
+        with pytest.raises(ValueError):
+            EventQueue(handler=print, workers=0)
+
+        with pytest.raises(ValueError):
+            EventQueue(handler=print, max_size=0)
+
+    def test_drains_pending_events_on_shutdown(self):
+        # GIVEN a started queue whose single worker is busy
+        release = threading.Event()
+        handled = []
+
+        def handler(event):
+            release.wait(timeout=5)
+            handled.append(event["id"])
+
+        events = EventQueue(handler=handler, workers=1, max_size=10)
+        events.start()
+
+        # WHEN a few events are submitted
+        for nr in range(3):
+            assert events.submit({"id": nr}) is True
+
+        # AND WHEN the queue is shut down
+        release.set()
+        events.shutdown(timeout=5)
+
+        # THEN every accepted event was handled, in order, and no new events are accepted
+        assert handled == [0, 1, 2]
+        assert events.depth == 0
+        assert events.submit({"id": 3}) is False
+
+    def test_rejects_events_when_full(self):
+        # GIVEN a queue with one slot and a blocked worker
+        release = threading.Event()
+        started = threading.Event()
+
+        def handler(event):
+            started.set()
+            release.wait(timeout=5)
+
+        events = EventQueue(handler=handler, workers=1, max_size=1)
+
+        # WHEN events are submitted before it's started
+        # THEN they're rejected
+        assert events.submit({}) is False
+
+        events.start()
+        assert events.submit({"id": 0}) is True
+        started.wait(timeout=5)
+
+        # AND WHEN more events than slots are submitted
+        # THEN the extra ones are rejected
+        assert events.submit({"id": 1}) is True
+        assert events.depth == 1
+        assert events.submit({"id": 2}) is False
+
+        release.set()
+        events.shutdown(timeout=5)
+
+    def test_keeps_working_after_a_failing_event(self):
+        # GIVEN a handler that fails on some events
+        handled = []
+
+        def handler(event):
+            if event.get("fail"):
+                raise RuntimeError("boom")
+            handled.append(event["id"])
+
+        events = EventQueue(handler=handler, workers=1, max_size=10)
+        events.start()
+
+        # WHEN a failing event is followed by a valid one
+        events.submit({"id": 0, "fail": True})
+        events.submit({"id": 1})
+        events.shutdown(timeout=5)
+
+        # THEN the worker survived and handled the second one
+        assert handled == [1]